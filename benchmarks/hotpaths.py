@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+'''
+Measures the text generation and parsing functions that run on the event loop.
+
+Every case uses fixed inputs and seeds, and starts each repeat from the same state,
+so runs are comparable. Timings are the median of several repeats, per call.
+Results can be saved as a baseline, and later runs compared against it; regressions
+beyond the threshold make the run fail.
+
+Run with `python -m benchmarks.hotpaths` from the repository root. Baselines are
+only meaningful on the machine that recorded them, so they are not committed:
+record one with `--save benchmarks/hotpaths.json` before a change, and check
+against it with `--compare benchmarks/hotpaths.json` after.
+'''
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import timeit
+from datetime import timedelta
+from random import Random
+from typing import Any, Callable, Coroutine
+
+from cogs import sh, tools, utils
+from cogs.utils import emoji
+
+POLL = '''Should I go outside
+
+🌻 Yes
+💻 No
+❤ Maybe
+\U0001f469\U0001f3fd\u200d\U0001f4bb Only to work
+🇫🇮 Only in Finland
+1: One
+b: Bee
+<:rocket:123456789012345678> Custom
+Nothing to see here
+
+I'll definitely go but I just want to feel validated / superior 🙂
+'''
+
+CHARS = "h\u00e9llo w\u00f6rld \U0001f469\u200d\U0001f4bb \U0001f1eb\U0001f1ee 1\ufe0f\u20e3 Z\u0337\u0322\u031ba\u0334 \t\u200b\u65e5\u672c\u8a9e" * 4
+
+def run(coro: Coroutine[Any, Any, Any]) -> Any:
+    '''Runs a coroutine that never actually suspends.'''
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("Coroutine suspended")
+
+class FakeMenu:
+    current_page = 0
+
+def chars_page() -> str:
+    source = tools.CharsSource(CHARS)
+    return run(source.format_page(FakeMenu, source.entries[0]))
+
+# Shared by the randomized cases, and reseeded before each repeat
+RNG = Random()
+
+# Caches emptied before each repeat of a case, so that every repeat starts cold
+CACHES: dict[str, Callable[[], None]] = {
+    "chars_page": tools.describe.cache_clear,
+}
+
+def cases() -> dict[str, Callable[[], Any]]:
+    '''Returns the benchmarked callables.'''
+    rng = RNG
+    keycaps = tools.Tools.__new__(tools.Tools)
+    trie = emoji.load("data/emoji.txt")
+    keycaps.keycaps = {}
+    keycaps.define_keycaps()
+    duration = timedelta(days=3, hours=1, minutes=2, seconds=3, milliseconds=456)
+    return {
+        "to_bottom": lambda: sh.to_bottom("0.5488135039273248", 6),
+        "keysmash": lambda: sh.keysmash(44, 0.9, rng=rng),
+        "keysmashes_bottom": lambda: sh.keysmashes([44, 42, 42, 41, 4, 5, 6, *(7, 8, 9, 10) * 20], 0.9, rng=rng),
+        "hammer": lambda: sh.hammer(44, 0.9, rng),
+        "drill_peck": lambda: sh.drill_peck(44, 0.9, rng),
+        "humanize_duration": lambda: utils.humanize_duration(duration, millis=True),
+        "graphemes": lambda: list(tools.graphemes(CHARS)),
+        "chars_page": chars_page,
+        "define_keycaps": keycaps.define_keycaps,
+        "parse_poll": lambda: tools.parse_poll(POLL, keycaps.keycaps, trie),
+    }
+
+def measure(name: str, function: Callable[[], Any], repeat: int) -> float:
+    def setup():
+        RNG.seed(0)
+        if name in CACHES:
+            CACHES[name]()
+    timer = timeit.Timer(function, setup=setup)
+    number, _ = timer.autorange()
+    return statistics.median(timer.repeat(repeat=repeat, number=number)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7, help="repeats per case, of which the median is kept")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.5, help="slowdown over the baseline that counts as a regression")
+    parser.add_argument("cases", nargs="*", help="cases to run, all by default")
+    args = parser.parse_args()
+
+    available = cases()
+    names = args.cases or [*available]
+    baseline: dict[str, float] = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+    results: dict[str, float] = {}
+    regressions = []
+    print(f"{'case':<20} {'time':>10} {'baseline':>10} {'change':>8}")
+    for name in names:
+        results[name] = seconds = measure(name, available[name], args.repeat)
+        line = f"{name:<20} {seconds * 1e6:>7.2f} µs"
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += f" {baseline[name] * 1e6:>7.2f} µs {change:>+7.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=4)
+            fp.write("\n")
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
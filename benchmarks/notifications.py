@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+'''
+Measures how XKCD notification delivery time scales with the number of subscribers.
+
+Discord is replaced by a fake HTTP backend with a fixed round trip latency,
+and the database is in a temporary directory. The previous one-at-a-time delivery is kept
+here as a baseline.
+
+Run with `python -m benchmarks.notifications` from the repository root.
+'''
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+
+import discord
+
+from cogs.utils.db import Database
+from cogs.xkcd import Xkcd
+
+class FakeHTTP:
+    '''Stands in for `discord.http.HTTPClient`, answering after a fixed latency.'''
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+
+    async def start_private_message(self, user_id: int):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return {"id": str(user_id + 1)}
+
+    async def send_message(self, channel_id, content, *, embed=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return {"id": "0", "channel_id": str(channel_id)}
+
+class FakeBot:
+    '''The parts of `Bot` used by the notification code.'''
+    color = discord.Color.default()
+
+    def __init__(self, db: Database, latency: float):
+        self.db = db
+        self.http = FakeHTTP(latency)
+
+    async def log_raw(self, **kwargs):
+        pass
+
+async def serial_notifications(cog: Xkcd, latest_number: int):
+    '''The delivery loop as it was before notifications were sent concurrently.'''
+    rows = await cog.bot.db.fetchall("SELECT id FROM users WHERE xkcd_remind = 1;")
+    for (id,) in rows:
+        with contextlib.suppress(discord.Forbidden):
+            for num in range(cog.latest_number + 1, latest_number + 1):
+                cog.embeds.clear() # every call used to go to XKCD
+                embed = await cog.query_xkcd(num)
+                channel = await cog.bot.http.start_private_message(id)
+                await cog.bot.http.send_message(channel["id"], f"XKCD #`{num}`", embed=embed.to_dict())
+
+async def setup(subscribers: int, comics: int, latency: float) -> Xkcd:
+    # Readers need their own connections, which an in-memory database can't have
+    db = await Database.connect(os.path.join(tempfile.mkdtemp(), "notifications.db"))
+    await db.executemany(
+        "INSERT INTO users (id, xkcd_remind) VALUES (?, 1);",
+        [(id,) for id in range(1, subscribers + 1)]
+    )
+    cog = Xkcd(FakeBot(db, latency)) # type: ignore
+    for num in range(1, comics + 1):
+        await cog.store_xkcd({
+            "num": num, "safe_title": f"Comic {num}", "alt": "Alt text", "transcript": "",
+            "img": "https://imgs.xkcd.com/comics/example.png", "year": "2021", "month": "1", "day": "1",
+        })
+    return cog
+
+async def timed(cog: Xkcd, deliver, comics: int) -> float:
+    cog.latest_number = 0
+    start = time.perf_counter()
+    await deliver(cog, comics)
+    return time.perf_counter() - start
+
+async def measure(subscribers: int, comics: int, latency: float) -> tuple[float, float, float]:
+    serial = await timed(await setup(subscribers, comics, latency), serial_notifications, comics)
+    cog = await setup(subscribers, comics, latency)
+    cold = await timed(cog, Xkcd.send_notifications, comics)
+    # The second run reuses the DM channels cached by the first
+    warm = await timed(cog, Xkcd.send_notifications, comics)
+    return serial, cold, warm
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.01, help="fake round trip latency in seconds")
+    parser.add_argument("--comics", type=int, default=1, help="new comics per notification")
+    parser.add_argument("subscribers", type=int, nargs="*", default=[10, 50, 100, 250])
+    args = parser.parse_args()
+
+    print(f"{'subscribers':>11} {'serial':>9} {'cold':>9} {'warm':>9} {'speedup':>8}")
+    for subscribers in args.subscribers:
+        serial, cold, warm = await measure(subscribers, args.comics, args.latency)
+        print(f"{subscribers:>11} {serial:>8.3f}s {cold:>8.3f}s {warm:>8.3f}s {serial / warm:>7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,14 +6,22 @@ from __future__ import annotations
 import contextlib
 from datetime import datetime
 import functools
-from typing import Any, Callable, Coroutine
+import logging
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Coroutine, Iterable
 
-import aiohttp
-import asqlite
 import discord
 from discord.ext import commands
 
 import config
+from cogs.utils.db import Database
+from cogs.utils.http import HTTPClient
+from cogs.utils.reload import source_hash, validate_extension
+from cogs.utils.stats import LatencyStats
+from cogs.utils.watchdog import LoopWatchdog
 
 class Ctx(commands.Context):
     '''A custom command context.'''
@@ -21,11 +29,31 @@ class Ctx(commands.Context):
 
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
+        # Timestamps of the invocation phases, from time.perf_counter()
+        self.started = time.perf_counter()
+        self.context_built = self.started
+        self.invoke_started = self.started
+        self.callback_started = self.started
+
+    def record_latency(self, phase: str, seconds: float):
+        '''Records the duration of a phase of this command's invocation.'''
+        if self.command is not None:
+            cog = self.cog.qualified_name if self.cog is not None else "No cog"
+            self.bot.latency_stats.record(self.command.qualified_name, cog, phase, seconds)
+
+    async def send(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().send(*args, **kwargs)
+        finally:
+            self.record_latency("send", time.perf_counter() - start)
 
     async def react(self, emoji):
         '''Adds a reaction to this message.'''
+        start = time.perf_counter()
         with contextlib.suppress(discord.HTTPException):
             await self.message.add_reaction(emoji)
+        self.record_latency("react", time.perf_counter() - start)
 
     async def rocket(self) -> None:
         '''Reacts with a rocket emoji.'''
@@ -56,52 +84,202 @@ class Ctx(commands.Context):
 
 class Bot(commands.Bot):
     '''Custom bot class with convenience methods and attributes.'''
-    def __init__(self, prefixes: list[str], *, color: discord.Color=discord.Color.default(), db: str, webhook_id: int, secret_password: str, **kwargs):
+    def __init__(self, prefixes: list[str], *, color: discord.Color=discord.Color.default(), db: str, webhook_id: int, secret_password: str, profile_startup: bool = False, **kwargs):
         self.exit_code = 0
+        self.profile_startup = profile_startup
         self.color = color
         self.webhook_id = webhook_id
         self.secret_password = secret_password
         self.cog_names = config.cogs
+        # Source digests of loaded extensions, to skip reloading unchanged ones
+        self.extension_hashes: dict[str, str] = {}
+        self.latency_stats = LatencyStats()
+        # IDs of blocked users, kept in sync with the users table
+        self.blocked: set[int] = set()
+        # Matches any prefix, so that other messages are dropped before parsing
+        self.prefix_regex = re.compile("|".join([*map(re.escape, prefixes), r"<@!?(?P<mention>\d+)> "]))
+        self.message_counts: Counter[str] = Counter()
+        # Execution times of extension modules, recorded when profiling startup
+        self.import_times: dict[str, float] = {}
         # late initialization, forced type-ignore
         self.start_time: datetime = None # type: ignore
         self.log: Callable[..., Coroutine[Any]] = None # type: ignore
         self.log_raw: Callable[..., Coroutine[Any]] = None # type: ignore
-        self.db: asqlite.Connection = None # type: ignore
-        self.session: aiohttp.ClientSession = None # type: ignore
+        self.flush_logs: Callable[[], Coroutine[Any]] = None # type: ignore
+        self.db: Database = None # type: ignore
+        self.session: HTTPClient = None # type: ignore
 
         super().__init__(command_prefix=commands.when_mentioned_or(*prefixes), **kwargs)
+        self.watchdog = LoopWatchdog(self.loop, self.report_stall)
+        self.add_check(self.not_blocked)
+        self.before_invoke(self.before_command)
+        self.after_invoke(self.after_command)
+        timings = []
         for cog in config.cogs:
             try:
+                start = time.perf_counter()
                 self.load_extension(cog)
+                imported = self.import_times.pop(cog, 0.0)
+                timings.append((cog, imported, time.perf_counter() - start - imported))
+                self.extension_hashes[cog] = source_hash(cog)
             except Exception as exc:
                 print(f"Could not load extension {cog} due to {exc.__class__.__name__}: {exc}")
+        if profile_startup:
+            print(f"{'Extension':<24} {'Import':>9} {'Setup':>9}")
+            for cog, imported, setup in sorted(timings, key=lambda row: -row[1] - row[2]):
+                print(f"{cog:<24} {imported * 1000:>6.1f} ms {setup * 1000:>6.1f} ms")
+            self.startup_began = time.perf_counter()
 
         # Connection acquisition must be asynchronous
         self.loop.create_task(self.connect_sessions(db=db))
     
+    def _load_from_module_spec(self, spec, key):
+        if self.profile_startup:
+            # Times the module body and its imports separately from setup, without running it twice
+            exec_module = spec.loader.exec_module
+            def timed(module):
+                start = time.perf_counter()
+                try:
+                    exec_module(module)
+                finally:
+                    self.import_times[key] = time.perf_counter() - start
+            spec.loader.exec_module = timed
+        super()._load_from_module_spec(spec, key)
+
     async def close(self):
         print("Shutting down...")
+        self.watchdog.stop()
         await self.session.close()
-        await self.db.close()
+        try:
+            await self.db.close()
+        except Exception as exc:
+            # Shutdown must finish regardless
+            if self.log_raw is not None:
+                await self.log_raw(level=logging.ERROR, message="Buffered user updates were lost on shutdown", exc=exc)
+        # Before the HTTP session that the log webhook uses is closed
+        if self.flush_logs is not None:
+            await self.flush_logs()
         await super().close()
 
     async def connect_sessions(self, *, db: str):
-        self.db = await asqlite.connect(db) # type: ignore
-        self.session = aiohttp.ClientSession()
+        self.watchdog.start()
+        self.db = await Database.connect(db, report=self.report_write_failure)
+        rows = await self.db.fetchall(
+            '''
+            SELECT id FROM users WHERE blocked = 1;
+            '''
+        )
+        self.blocked = {id for (id,) in rows}
+        self.session = HTTPClient()
         
         await self.wait_until_ready()
         self.start_time = datetime.utcnow()
+        if self.profile_startup:
+            print(f"Ready {time.perf_counter() - self.startup_began:.2f} s after loading extensions")
         
         self.dispatch("initialized")
         print(f"Logged in as {self.user} (ID: {self.user.id})")
         print("Invite:", discord.utils.oauth_url(str(self.user.id)))
 
+    async def report_stall(self, duration: float, stack: str):
+        '''Reports a blocked event loop, along with the stack that was blocking it.'''
+        if self.log_raw is None:
+            return
+        await self.log_raw(
+            level=logging.WARNING,
+            message=f"Event loop blocked for {duration:.2f}s (gateway latency {self.latency * 1000:.0f} ms)\n"
+            f"```py\n{stack[-1800:]}```"
+        )
+
+    async def report_write_failure(self, exc: BaseException):
+        '''Reports a failed background database write, which is retried later.'''
+        if self.log_raw is None:
+            return
+        await self.log_raw(
+            level=logging.ERROR,
+            message="Buffered user updates failed to commit, retrying",
+            exc=exc
+        )
+
+    def reload_changed(self, names: Iterable[str], *, force: bool = False) -> list[tuple[str, str, float]]:
+        '''Reloads those of the given extensions whose source changed, carrying over cog state.
+
+        Returns the name, outcome and duration of each reload attempted.
+        Cogs may define `cog_export_state` to return state for their replacement,
+        which is handed to the replacement's `cog_import_state`.
+        '''
+        results = []
+        for name in names:
+            start = time.perf_counter()
+            try:
+                digest = source_hash(name)
+                if not force and name in self.extensions and self.extension_hashes.get(name) == digest:
+                    continue
+                # A broken module never replaces a working one
+                validate_extension(name)
+                state = {
+                    cog.qualified_name: cog.cog_export_state()
+                    for cog in self.cogs.values()
+                    if type(cog).__module__ == name and hasattr(cog, "cog_export_state")
+                }
+                try:
+                    if name in self.extensions:
+                        self.reload_extension(name)
+                    else:
+                        self.load_extension(name)
+                finally:
+                    # If setup fails, discord.py restores the previous module with fresh cogs,
+                    # which need the exported state just as much as the new ones would
+                    self.adopt_cogs(name, state)
+                self.extension_hashes[name] = digest
+                results.append((name, "reloaded", time.perf_counter() - start))
+            except Exception as exc:
+                results.append((name, f"{exc.__class__.__name__}: {exc}", time.perf_counter() - start))
+        return results
+
+    def adopt_cogs(self, name: str, state: dict[str, Any]):
+        '''Hands the exported state to the freshly loaded cogs of an extension, and initializes them.'''
+        for cog in [cog for cog in self.cogs.values() if type(cog).__module__ == name]:
+            if cog.qualified_name in state and hasattr(cog, "cog_import_state"):
+                cog.cog_import_state(state[cog.qualified_name])
+            # Only the new cogs are initialized, and only if the bot already was
+            if self.start_time is not None:
+                for event, listener in cog.get_listeners():
+                    if event == "on_initialized":
+                        self.loop.create_task(listener())
+
     def cursor(self):
-        '''Obtains a cursor once awaited.'''
+        '''Obtains a writer cursor, held until the `async with` block exits.'''
         return self.db.cursor()
 
+    def has_prefix(self, content: str) -> bool:
+        match = self.prefix_regex.match(content)
+        return match is not None and (match["mention"] is None or int(match["mention"]) == self.user.id)
+
+    async def process_commands(self, message: discord.Message):
+        self.message_counts["seen"] += 1
+        # Non-commands and blocked users are turned away before any parsing happens
+        if message.author.bot or message.author.id in self.blocked or not self.has_prefix(message.content):
+            self.message_counts["filtered"] += 1
+            return
+        ctx = await self.get_context(message)
+        if ctx.command is not None:
+            self.message_counts["invoked"] += 1
+        await self.invoke(ctx)
+
+    # Also covers invocations that don't go through process_commands
+    async def not_blocked(self, ctx: Ctx) -> bool:
+        return ctx.author.id not in self.blocked
+
     # Hook for custom context, as well as reply invokes
     async def get_context(self, message: discord.Message, *, cls=commands.Context):
+        start = time.perf_counter()
+        ctx = await self.build_context(message)
+        ctx.started = start
+        ctx.context_built = time.perf_counter()
+        return ctx
+
+    async def build_context(self, message: discord.Message) -> Ctx:
         if message.reference is not None:
             resolved = message.reference.resolved
             if isinstance(resolved, discord.Message):
@@ -109,12 +287,29 @@ class Bot(commands.Bot):
                 return await super().get_context(resolved, cls=Ctx)
         return await super().get_context(message, cls=Ctx)
 
+    async def invoke(self, ctx: Ctx):
+        ctx.invoke_started = time.perf_counter()
+        await super().invoke(ctx)
+
+    # Global invoke hooks, for latency instrumentation
+    # Checks and argument conversion both happen between `invoke` and `before_invoke`
+    async def before_command(self, ctx: Ctx):
+        ctx.callback_started = time.perf_counter()
+        ctx.record_latency("context", ctx.context_built - ctx.started)
+        ctx.record_latency("checks", ctx.callback_started - ctx.invoke_started)
+
+    async def after_command(self, ctx: Ctx):
+        now = time.perf_counter()
+        ctx.record_latency("callback", now - ctx.callback_started)
+        ctx.record_latency("total", now - ctx.started)
+
 bot = Bot(
     ["rocket ", "Rocket "], # auto-capitalization aware
     color=discord.Color(0xe0e0f0),
     db=config.db,
     webhook_id=config.webhook_id,
     secret_password = config.secret_password,
+    profile_startup="--profile-startup" in sys.argv,
     allowed_mentions=discord.AllowedMentions(everyone=False),
     intents=discord.Intents(
         guilds=True,
@@ -3,7 +3,13 @@ Converts raw data into not-as-raw data
 '''
 
 import json
+import os
 
-with open("raw_data/channel_index.json") as fp:
-    markov_channels = json.load(fp)
+from cogs.utils import artstore
 
+with open("data/icons.json", encoding="utf-8") as fp:
+    artstore.build(json.load(fp), "data/icons.bin")
+
+if os.path.exists("raw_data/channel_index.json"):
+    with open("raw_data/channel_index.json") as fp:
+        markov_channels = json.load(fp)
@@ -3,20 +3,25 @@
 from __future__ import annotations
 
 import asyncio
+import codecs
 import contextlib
 import datetime
+import gzip
 import io
 import logging
+import os
+import signal
+import sqlite3
 import textwrap
 from urllib import parse
 from asyncio import subprocess
 from datetime import timedelta
 from typing import TYPE_CHECKING, Any, TypeVar, Union
 
+import aiohttp
 import dbouncer
 import discord
-from discord.ext import menus  # type: ignore
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 if TYPE_CHECKING:
     from bot import Bot, Ctx
@@ -26,31 +31,63 @@ else:
 _T = TypeVar("_T")
 Sdict = dict[str, _T]
 
-class EasyPaginator(menus.ListPageSource):
-    def __init__(self, data):
-        super().__init__(data, per_page=1)
-    async def format_page(self, menu, page):
-        return f"{page}\n`Page {menu.current_page + 1}/{len(self.entries)}`"
+class ShellOutput:
+    '''The output of a shell command, as the tail that fits in a message and a compressed copy of all of it.'''
+    def __init__(self, tail_size: int, max_bytes: int):
+        self.tail_size = tail_size
+        self.max_bytes = max_bytes
+        self.tail = ""
+        self.total = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = io.BytesIO()
+        self.compressed = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+
+    async def read(self, stream: asyncio.StreamReader):
+        while chunk := await stream.read(4096):
+            if self.total < self.max_bytes:
+                self.compressed.write(chunk[:self.max_bytes - self.total])
+            self.total += len(chunk)
+            self.tail = (self.tail + self.decoder.decode(chunk))[-self.tail_size:]
+
+    @property
+    def overflowed(self) -> bool:
+        return self.total > self.tail_size
+
+    def file(self) -> discord.File:
+        '''Finishes the compressed copy of the output.'''
+        if self.total > self.max_bytes:
+            self.compressed.write(f"\n[{self.total - self.max_bytes} more bytes not kept]\n".encode())
+        self.compressed.close()
+        self.buffer.seek(0)
+        return discord.File(self.buffer, "output.txt.gz")
 
 class Admin(dbouncer.DefaultBouncer, command_attrs=dict(hidden=True)): # type: ignore
     '''Bot administration commands.'''
 
+    KANTTIINIT = "https://kitchen.kanttiinit.fi"
+    # Restaurant metadata rarely changes, menus are refreshed by prefetch_yum
+    YUM_METADATA_TTL = 24 * 60 * 60
+    YUM_MENU_TTL = 60 * 60
+    # Shell output shown in the message, and kept compressed in total
+    SHELL_TAIL_SIZE = 1900
+    SHELL_MAX_BYTES = 16 * 1024 * 1024
+    SHELL_EDIT_INTERVAL = 1.5
+    SHELL_TIMEOUT = 300
+
     def __init__(self, bot: Bot, **kwargs) -> None:
-        self.blocked = set()
         self.bot = bot
         self.last_value = None
         super().__init__(bot, **kwargs)
     
     @commands.Cog.listener()
     async def on_initialized(self):
-        async with self.bot.cursor() as cur:
-            await cur.execute(
-                '''
-                SELECT id FROM users WHERE blocked == 1;
-                '''
-            )
-            results = await cur.fetchall()
-            self.blocked = set(results)
+        if not self.prefetch_yum.is_running():
+            self.prefetch_yum.start()
+
+    def cog_unload(self):
+        super().cog_unload()
+        if self.prefetch_yum.is_running():
+            self.prefetch_yum.cancel()
 
     async def after_leave(self, guild: discord.Guild, *, new: bool):
         await self.bot.log_raw(
@@ -64,45 +101,134 @@ class Admin(dbouncer.DefaultBouncer, command_attrs=dict(hidden=True)): # type: i
             message=f"Guild `{guild.name}` (ID: {guild.id}`) left automatically. Guild count: {len(self.bot.guilds)}!"
         )
 
-    async def run_shell(self, command: str, ctx: Ctx, *, typing: bool = False) -> menus.MenuPages:
-        '''Run a shell command, obtain output and display it as a menu.'''
-        if typing: # Using a with block is a bit difficult here
-            await ctx.trigger_typing()
+    async def run_shell(self, command: str, ctx: Ctx) -> discord.Message:
+        '''Run a shell command, showing the tail of its output live.
+
+        The full output is attached compressed if it doesn't fit. The whole process group
+        is killed once the command finishes or times out.
+        '''
         proc = await asyncio.create_subprocess_shell(
             command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
         )
-        result = await proc.communicate()
-        stdout, stderr = (stream.decode() if stream else "" for stream in result)
-        merged = stdout + "\n" + stderr
-        msgs = [
-            f"Return code: {proc.returncode}\n```{merged[i:i+1900]}```"
-            for i in range(0, len(merged), 1900)
-        ]
-        menu = menus.MenuPages(source=EasyPaginator(msgs), delete_message_after=True)
-        await menu.start(ctx)
-        return menu
+        output = ShellOutput(self.SHELL_TAIL_SIZE, self.SHELL_MAX_BYTES)
+        def render(status: str) -> str:
+            tail = output.tail.replace("`", "\u200b`")[-self.SHELL_TAIL_SIZE:] or " "
+            return f"{status}\n```{tail}```"
+        message = await ctx.send(render("Running..."))
+
+        async def update():
+            shown = ""
+            while True:
+                await asyncio.sleep(self.SHELL_EDIT_INTERVAL)
+                if output.tail != shown:
+                    shown = output.tail
+                    with contextlib.suppress(discord.HTTPException):
+                        await message.edit(content=render("Running..."))
+
+        async def complete():
+            assert proc.stdout is not None
+            await output.read(proc.stdout)
+            await proc.wait()
+
+        updater = self.bot.loop.create_task(update())
+        try:
+            await asyncio.wait_for(complete(), self.SHELL_TIMEOUT)
+            status = f"Return code: {proc.returncode}"
+        except asyncio.TimeoutError:
+            status = f"Timed out after {self.SHELL_TIMEOUT} seconds"
+        finally:
+            updater.cancel()
+            # The shell's children are in its process group, and must not outlive it,
+            # even if they were left running in the background after it exited
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL)
+            await proc.wait()
+        # The message may have been deleted in the meantime
+        with contextlib.suppress(discord.HTTPException):
+            await message.edit(content=render(status))
+        if output.overflowed:
+            await ctx.send(f"Full output ({output.total} bytes):", file=output.file())
+        return message
 
     async def cog_check(self, ctx: Ctx):
         return await self.bot.is_owner(ctx.author)
 
     @commands.command()
     async def sh(self, ctx: Ctx, *, cmd: str):
-        await self.run_shell(cmd, ctx, typing=True)
+        await self.run_shell(cmd, ctx)
     
     @commands.command()
     async def sql(self, ctx: Ctx, query: str, *args):
-        async with ctx.cursor() as cur:
-            await cur.execute(
-                query,
-                args
-            )
-            result = [list(row) for row in await cur.fetchall()]
+        try:
+            # Read-only queries run on the reader pool, so they don't wait on writes
+            async with self.bot.db.reader() as conn:
+                result = [list(row) for row in await conn.fetchall(query, args)]
+        except sqlite3.OperationalError as error:
+            if "readonly" not in str(error):
+                raise
+            async with ctx.cursor() as cur:
+                await cur.execute(
+                    query,
+                    args
+                )
+                result = [list(row) for row in await cur.fetchall()]
         lines = "\n".join(" | ".join(str(column) for column in row) for row in result)
         result = f"Success. Results: ```{lines}```"
         await ctx.send(result)
+
+    @commands.command(name="http")
+    async def http_stats(self, ctx: Ctx):
+        lines = [f"{'Host':<24} {'Reqs':>5} {'Errs':>4} {'Rtry':>4} {'Hits':>5} {'Coal':>4} {'p50':>6} {'p95':>6}"]
+        for host, stats in sorted(self.bot.session.stats.items()):
+            lines.append(
+                f"{host[:24]:<24} {stats.requests:>5} {stats.errors:>4} {stats.retries:>4} "
+                f"{stats.cache_hits:>5} {stats.coalesced:>4} "
+                f"{stats.percentile(0.5) * 1000:>4.0f}ms {stats.percentile(0.95) * 1000:>4.0f}ms"
+            )
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
     
+    @commands.command()
+    async def stats(self, ctx: Ctx, *, command: str = None):
+        '''Shows command latency percentiles, per command and per cog, or per phase of a single command.'''
+        stats = self.bot.latency_stats
+        def row(name: str, histogram) -> str:
+            return (
+                f"{name[:20]:<20} {histogram.total:>5} "
+                + " ".join(f"{histogram.quantile(q) * 1000:>7.1f}" for q in (0.5, 0.95, 0.99))
+            )
+        header = f"{'':<20} {'n':>5} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}"
+        if command is not None:
+            if command not in stats.commands:
+                return await ctx.boom(f"No data for `{command}`")
+            phases = stats.commands[command]
+            lines = [header, *(row(phase, phases[phase]) for phase in stats.PHASES if phase in phases)]
+        else:
+            counts = self.bot.message_counts
+            lines = [
+                f"Messages: {counts['seen']} seen, {counts['filtered']} filtered, {counts['invoked']} invoked",
+                "",
+                header.replace(" " * 20, f"{'Command':<20}", 1),
+            ]
+            by_total = sorted(stats.commands.items(), key=lambda item: -item[1]["total"].quantile(0.95))
+            lines.extend(row(name, phases["total"]) for name, phases in by_total)
+            lines.append("")
+            lines.append(header.replace(" " * 20, f"{'Cog':<20}", 1))
+            lines.extend(row(name, phases["total"]) for name, phases in sorted(stats.cogs.items()))
+        await ctx.send("```\n" + "\n".join(lines)[:1980] + "\n```")
+
+    @commands.command()
+    async def lag(self, ctx: Ctx):
+        '''Shows event loop lag and gateway latency.'''
+        watchdog = self.bot.watchdog
+        await ctx.send(
+            f"Loop lag: `{watchdog.lag * 1000:.1f} ms` (max `{watchdog.max_lag * 1000:.1f} ms`), "
+            f"stalls: `{watchdog.stalls}`, gateway latency: `{self.bot.latency * 1000:.0f} ms`"
+        )
+
     @commands.command(name="eval")
     async def eval_python(self, ctx: Ctx, *, code: str):
         # no code blocks
@@ -144,21 +270,23 @@ class Admin(dbouncer.DefaultBouncer, command_attrs=dict(hidden=True)): # type: i
     
     @commands.group(invoke_without_command=True)
     async def load(self, ctx: Ctx, *cogs):
+        # Cogs named explicitly are reloaded even if unchanged
         if len(cogs) == 0:
-            for cog in self.bot.cog_names:
-                self.bot.reload_extension(cog)
+            results = self.bot.reload_changed(self.bot.cog_names)
         else:
-            for cog in cogs:
-                self.bot.reload_extension("cogs." + cog)
-        self.bot.dispatch("initialized")
-        await ctx.rocket()
+            results = self.bot.reload_changed(["cogs." + cog for cog in cogs], force=True)
+        await self.report_reload(ctx, results)
 
     @load.command()
     async def git(self, ctx: Ctx):
-        await self.run_shell("git pull", ctx, typing=True)
-        for cog in self.bot.cog_names:
-            self.bot.reload_extension(cog)
-        self.bot.dispatch("initialized")
+        await self.run_shell("git pull", ctx)
+        await self.report_reload(ctx, self.bot.reload_changed(self.bot.cog_names))
+
+    async def report_reload(self, ctx: Ctx, results: list[tuple[str, str, float]]):
+        if not results:
+            return await ctx.send("No changes.")
+        lines = [f"{name:<16} {seconds * 1000:>7.1f} ms  {outcome}" for name, outcome, seconds in results]
+        await ctx.send("```\n" + "\n".join(lines)[:1980] + "\n```")
 
     async def update_presence(
         self,
@@ -216,66 +344,62 @@ class Admin(dbouncer.DefaultBouncer, command_attrs=dict(hidden=True)): # type: i
     async def block(self, ctx: Ctx, user: Union[discord.User, int]):
         if isinstance(user, discord.User):
             user = user.id
-        async with ctx.cursor() as cur:
-            await cur.execute(
-                '''
-                UPDATE users
-                SET blocked = 1
-                WHERE id == ?;
-                ''',
-                (user,)
-            )
-            await cur.execute(
-                '''
-                INSERT OR IGNORE INTO users (id, blocked)
-                VALUES (?, 1);
-                ''',
-                (user,)
-            )
+        self.bot.blocked.add(user)
+        self.bot.db.users.update(user, blocked=1)
         await ctx.rocket()
 
     @commands.command()
     async def unblock(self, ctx: Ctx, user: Union[discord.User, int]):
         if isinstance(user, discord.User):
             user = user.id
-        async with ctx.cursor() as cur:
-            await cur.execute(
-                '''
-                UPDATE users
-                SET blocked = 0
-                WHERE id == ?;
-                ''',
-                (user,)
-            )
-            await cur.execute(
-                '''
-                INSERT OR IGNORE INTO users (id, blocked)
-                VALUES (?, 0);
-                ''',
-                (user,)
-            )
+        self.bot.blocked.discard(user)
+        self.bot.db.users.update(user, blocked=0)
         await ctx.rocket()
 
-    @commands.command()
-    async def yum(self, ctx: Ctx, tomorrow: bool = False):
-        async with self.bot.session.get("https://kitchen.kanttiinit.fi/areas?idsOnly=1") as resp:
-            areas = await resp.json()
+    async def fetch_yum(self, day: datetime.date, *, refresh: bool = False):
+        '''Fetches the restaurants of the area and their menus for a day, indexed by restaurant ID.'''
+        areas = (await self.bot.session.get(
+            f"{self.KANTTIINIT}/areas?idsOnly=1",
+            ttl=self.YUM_METADATA_TTL
+        )).json()
         restaurant_ids = [str(id) for area in areas if area["id"] == 1 for id in area["restaurants"]]
         id_str = ",".join(restaurant_ids)
-        async with self.bot.session.get(f"https://kitchen.kanttiinit.fi/restaurants?ids={id_str}&priceCategories=student,studentPremium") as resp:
-            restaurants: list[Sdict[Any]] = await resp.json()
+        restaurants_resp, menus_resp = await asyncio.gather(
+            self.bot.session.get(
+                f"{self.KANTTIINIT}/restaurants?ids={id_str}&priceCategories=student,studentPremium",
+                ttl=self.YUM_METADATA_TTL
+            ),
+            self.bot.session.get(
+                f"{self.KANTTIINIT}/menus?restaurants={id_str}&days={day}",
+                ttl=self.YUM_MENU_TTL,
+                refresh=refresh
+            ),
+        )
+        restaurants: dict[int, Sdict[Any]] = {r["id"]: r for r in restaurants_resp.json()}
+        menus: Sdict[Sdict[list[Sdict[Any]]]] = menus_resp.json()
+        return restaurant_ids, restaurants, menus
+
+    @tasks.loop(minutes=30)
+    async def prefetch_yum(self):
+        '''Keeps today's and tomorrow's menus cached.'''
+        today = datetime.date.today()
+        with contextlib.suppress(aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            for day in (today, today + datetime.timedelta(days=1)):
+                await self.fetch_yum(day, refresh=True)
+
+    @commands.command()
+    async def yum(self, ctx: Ctx, tomorrow: bool = False):
         day = datetime.date.today()
         if tomorrow:
             day = day + datetime.timedelta(days=1)
-        async with self.bot.session.get(f"https://kitchen.kanttiinit.fi/menus?restaurants={id_str}&days={day}") as resp:
-            menus: Sdict[Sdict[list[Sdict[Any]]]] = await resp.json()
+        restaurant_ids, restaurants, menus = await self.fetch_yum(day)
         panel = discord.Embed(
             color=self.bot.color,
             title="Open restaurants",
             url=f"https://kanttiinit.fi/?day={day}"
         )
         for id in restaurant_ids:
-            restaurant = [r for r in restaurants if r["id"] == int(id)][0]
+            restaurant = restaurants[int(id)]
 
             name = restaurant["name"]
             address = restaurant["address"]
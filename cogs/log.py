@@ -2,11 +2,21 @@
 
 from __future__ import annotations
 
-from discord.ext import commands, tasks
+from discord.ext import commands
+import aiohttp
+import asyncio
+import contextlib
+import datetime
 import discord
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import re
 import traceback
-from typing import TYPE_CHECKING, List
+from collections import deque
+from typing import TYPE_CHECKING, Any, Optional
 
 if TYPE_CHECKING:
     from bot import Bot, Ctx
@@ -40,9 +50,125 @@ def populate_log(embed: discord.Embed, title = None, message = None, exc: BaseEx
                 name=f"{exc.__class__.__name__}: {str(exc)}",
                 value=value[i:i+1024]
             )
-    else:
+    elif title is not None:
         embed.title = title
-    embed.description = message
+    if message is not None:
+        embed.description = message
+
+def fit_embed(embed: discord.Embed, limit: int) -> discord.Embed:
+    '''Drops trailing fields and trims the description until the embed fits in `limit` characters.'''
+    while len(embed) > limit and embed.fields:
+        embed.remove_field(len(embed.fields) - 1)
+    if len(embed) > limit and embed.description:
+        excess = len(embed) - limit
+        embed.description = embed.description[:max(0, len(embed.description) - excess - 1)] + "\u2026"
+    return embed
+
+def pack_embeds(embeds: list[discord.Embed], max_count: int, max_chars: int) -> list[list[discord.Embed]]:
+    '''Splits embeds, in order, into batches within the count and total size limits of a message.'''
+    batches: list[list[discord.Embed]] = []
+    batch: list[discord.Embed] = []
+    size = 0
+    for embed in embeds:
+        length = len(embed)
+        if batch and (len(batch) == max_count or size + length > max_chars):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(embed)
+        size += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+def make_record(level: int, title = None, message = None, exc: BaseException = None, ctx: Ctx = None) -> dict[str, Any]:
+    '''Returns the structured form of a log entry, as written to the local store.'''
+    record: dict[str, Any] = {
+        "time": datetime.datetime.utcnow().isoformat(),
+        "level": logging.getLevelName(level),
+        "levelno": level,
+        "title": title,
+        "message": message,
+    }
+    if exc is not None:
+        record["exception"] = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    if ctx is not None:
+        record.update({
+            "user": ctx.author.id,
+            "guild": ctx.guild.id if ctx.guild else None,
+            "channel": ctx.channel.id,
+            "message_id": ctx.message.id,
+            "content": ctx.message.content,
+        })
+    return record
+
+DURATION_REGEX = re.compile(r"(?:\d+[smhdw])+")
+DURATION_PART_REGEX = re.compile(r"(\d+)([smhdw])")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+def parse_time(value: str) -> datetime.datetime:
+    '''Parses either an ISO timestamp or a duration before now, such as `90m` or `1d12h`.'''
+    if DURATION_REGEX.fullmatch(value):
+        seconds = sum(int(n) * DURATION_UNITS[unit] for n, unit in DURATION_PART_REGEX.findall(value))
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+    return datetime.datetime.fromisoformat(value)
+
+# Most records a query returns, about as many as fit in a message
+MAX_QUERY_LIMIT = 50
+
+def parse_filters(args: tuple[str, ...]) -> dict[str, Any]:
+    '''Parses `key=value` query arguments into record filters.'''
+    filters: dict[str, Any] = {"limit": 10}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep:
+            raise commands.BadArgument(f"Expected `key=value`, got `{arg}`")
+        if key == "level":
+            levelno = logging.getLevelName(value.upper())
+            if not isinstance(levelno, int):
+                raise commands.BadArgument(f"Unknown level `{value}`")
+            filters["level"] = levelno
+        elif key in ("user", "guild", "limit"):
+            try:
+                filters[key] = int(value)
+            except ValueError:
+                raise commands.BadArgument(f"Expected an integer for `{key}`, got `{value}`") from None
+            if key == "limit":
+                if filters[key] < 1:
+                    raise commands.BadArgument(f"Expected a positive `limit`, got `{value}`")
+                filters[key] = min(filters[key], MAX_QUERY_LIMIT)
+        elif key in ("since", "until"):
+            try:
+                filters[key] = parse_time(value).isoformat()
+            except ValueError:
+                raise commands.BadArgument(f"Expected a timestamp or duration for `{key}`, got `{value}`") from None
+        else:
+            raise commands.BadArgument(f"Unknown filter `{key}`")
+    return filters
+
+def read_records(paths: list[str], filters: dict[str, Any]) -> list[dict[str, Any]]:
+    '''Returns the newest records matching the filters from the given files, oldest file first.'''
+    matches: deque[dict[str, Any]] = deque(maxlen=filters["limit"])
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as fp:
+            for line in fp:
+                # A crash mid-write can leave a truncated line behind
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["levelno"] < filters.get("level", logging.NOTSET):
+                    continue
+                if "user" in filters and record.get("user") != filters["user"]:
+                    continue
+                if "guild" in filters and record.get("guild") != filters["guild"]:
+                    continue
+                # ISO timestamps compare chronologically as strings
+                if "since" in filters and record["time"] < filters["since"]:
+                    continue
+                if "until" in filters and record["time"] > filters["until"]:
+                    continue
+                matches.append(record)
+    return list(matches)
 
 class Logging(commands.Cog):
     '''A custom webhook log.'''
@@ -55,27 +181,95 @@ class Logging(commands.Cog):
         logging.CRITICAL: discord.Color(0xc10508),
     }
 
+    # Discord's limits for a single webhook message
+    MAX_EMBEDS = 10
+    MAX_CHARS = 6000
+    # Records held while the webhook is slow or unavailable; the oldest are dropped beyond this
+    QUEUE_SIZE = 1000
+    # Seconds to wait for a fuller batch, unless an error is logged
+    LINGER = 60.0
+    # Attempts per batch, and the base of the exponential backoff between them (seconds)
+    MAX_ATTEMPTS = 5
+    RETRY_BACKOFF = 2.0
+    # Only records at this level or above are sent to the webhook. All records are stored locally.
+    WEBHOOK_LEVEL = logging.WARNING
+    # The local record store, rotated by size
+    STORE_PATH = "logs/records.jsonl"
+    STORE_MAX_BYTES = 5 * 1024 * 1024
+    STORE_BACKUPS = 5
+
     def __init__(self, bot: Bot):
         self.bot = bot
         self.bot.log = self.log
         self.bot.log_raw = self.log_raw
-        self.buffer: List[discord.Embed] = []
+        self.bot.flush_logs = self.flush
+        self.queue: asyncio.Queue[discord.Embed] = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        # Embeds taken off the queue by the consumer but not yet sent
+        self.inflight: list[discord.Embed] = []
+        # Set when a batch should be sent without waiting for it to fill up
+        self.urgent = asyncio.Event()
+        self.consumer: Optional[asyncio.Task] = None
         self.webhook = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        # Records are written to disk by a listener thread, off the event loop
+        os.makedirs(os.path.dirname(self.STORE_PATH), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            self.STORE_PATH,
+            maxBytes=self.STORE_MAX_BYTES,
+            backupCount=self.STORE_BACKUPS,
+            encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.store_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        self.store_listener = logging.handlers.QueueListener(self.store_queue, handler)
+        self.store_listener.start()
+        self.store_handler = logging.handlers.QueueHandler(self.store_queue)
     
     @commands.Cog.listener()
     async def on_initialized(self):
         self.webhook = await self.bot.fetch_webhook(self.bot.webhook_id)
-        if not self.flush_loop.is_running():
-            self.flush_loop.start()
+        if self.consumer is None or self.consumer.done():
+            self.consumer = self.bot.loop.create_task(self.consume())
 
     def cog_unload(self):
-        if self.flush_loop.is_running():
-            self.flush_loop.stop()
+        if self.consumer is not None:
+            self.consumer.cancel()
+        # Anything not handed over to a reloaded cog is sent before it's lost
+        embeds = self.take_pending()
+        if embeds:
+            self.bot.loop.create_task(self.send_all(embeds))
+        self.store_listener.stop()
+        self.store_listener.handlers[0].close()
+
+    def cog_export_state(self) -> dict[str, Any]:
+        return {"embeds": self.take_pending(), "webhook": self.webhook, "counts": (self.sent, self.dropped, self.failed)}
+
+    def cog_import_state(self, state: dict[str, Any]):
+        for embed in state["embeds"][-self.QUEUE_SIZE:]:
+            self.queue.put_nowait(embed)
+        self.webhook = state["webhook"]
+        self.sent, self.dropped, self.failed = state["counts"]
+
+    def store(self, record: dict[str, Any]):
+        '''Appends a record to the local store.'''
+        self.store_handler.handle(logging.makeLogRecord({
+            "levelno": record["levelno"],
+            "levelname": record["level"],
+            "msg": json.dumps(record),
+        }))
 
     async def append_log(self, embed, level = logging.DEBUG):
-        self.buffer.append(embed)
-        if len(self.buffer) >= 10 or level >= logging.ERROR:
-            await self.flush_buffer()
+        '''Queues an embed for the webhook. Never waits on the network.'''
+        if level < self.WEBHOOK_LEVEL:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(fit_embed(embed, self.MAX_CHARS))
+        if self.queue.qsize() >= self.MAX_EMBEDS or level >= logging.ERROR:
+            self.urgent.set()
 
     async def log(self, ctx: Ctx, *, level = logging.DEBUG, title = None, message = None, exc = None):
         embed = discord.Embed(
@@ -83,30 +277,112 @@ class Logging(commands.Cog):
         )
         provide_context(embed, ctx)
         populate_log(embed, title, message, exc)
+        self.store(make_record(level, title, message, exc, ctx))
         await self.append_log(embed, level)
 
     async def log_raw(self, *, level = logging.DEBUG, message = None, exc = None):
         embed = discord.Embed(
             color=self.COLORS[level],
         )
-        populate_log(embed, message, exc)
+        populate_log(embed, message=message, exc=exc)
+        self.store(make_record(level, message=message, exc=exc))
         await self.append_log(embed, level)
 
-    @tasks.loop(minutes=1)
-    async def flush_loop(self):
-        await self.flush_buffer()
-    
-    async def flush_buffer(self):
-        if len(self.buffer) == 0:
+    def take_pending(self) -> list[discord.Embed]:
+        '''Removes and returns the embeds in flight and in the queue, oldest first.'''
+        embeds = [*self.inflight]
+        self.inflight.clear()
+        while not self.queue.empty():
+            embeds.append(self.queue.get_nowait())
+        return embeds
+
+    async def consume(self):
+        '''Sends queued embeds to the webhook, packing as many as fit into each message.'''
+        while True:
+            embeds = self.inflight
+            embeds.append(await self.queue.get())
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.urgent.wait(), timeout=self.LINGER)
+            self.urgent.clear()
+            while not self.queue.empty():
+                embeds.append(self.queue.get_nowait())
+            for batch in pack_embeds(embeds, self.MAX_EMBEDS, self.MAX_CHARS):
+                await self.send_batch(batch)
+                del embeds[:len(batch)]
+
+    async def flush(self):
+        '''Sends everything in flight and queued right away, stopping the consumer.'''
+        if self.consumer is not None:
+            self.consumer.cancel()
+        await self.send_all(self.take_pending())
+
+    async def send_all(self, embeds: list[discord.Embed]):
+        if self.webhook is None:
+            self.dropped += len(embeds)
             return
-        for i in range(0, len(self.buffer), 10):
-            embeds = self.buffer[i:i+9]
-            await self.webhook.send( # type: ignore
-                embeds=embeds, 
-                username=f"{self.bot.user.name} logs",
-                avatar_url=str(self.bot.user.avatar_url)
+        for batch in pack_embeds(embeds, self.MAX_EMBEDS, self.MAX_CHARS):
+            await self.send_batch(batch)
+
+    async def send_batch(self, embeds: list[discord.Embed]):
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                await self.webhook.send( # type: ignore
+                    embeds=embeds, 
+                    username=f"{self.bot.user.name} logs",
+                    avatar_url=str(self.bot.user.avatar_url)
+                )
+            except discord.HTTPException as exc:
+                # Rate limits and server errors are worth another try, bad requests are not
+                if exc.status != 429 and exc.status < 500:
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            else:
+                self.sent += len(embeds)
+                return
+            await asyncio.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+        self.failed += len(embeds)
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def logs(self, ctx: Ctx):
+        '''Shows the state of the webhook log queue.'''
+        await ctx.send(
+            f"Queued: `{self.queue.qsize()}/{self.QUEUE_SIZE}`, sent: `{self.sent}`, "
+            f"dropped: `{self.dropped}`, failed: `{self.failed}`"
+        )
+
+    @logs.command(name="query")
+    @commands.is_owner()
+    async def logs_query(self, ctx: Ctx, *filters: str):
+        '''Shows the newest locally stored records matching the filters.
+        
+        Filters are given as `key=value`: `level`, `user`, `guild`, `limit`, and
+        `since`/`until`, which take an ISO timestamp or a duration such as `2h30m`.
+        '''
+        parsed = parse_filters(filters)
+        paths = [
+            path for path in (
+                *(f"{self.STORE_PATH}.{i}" for i in range(self.STORE_BACKUPS, 0, -1)),
+                self.STORE_PATH
             )
-        self.buffer.clear()
+            if os.path.exists(path)
+        ]
+        records = await self.bot.loop.run_in_executor(None, read_records, paths, parsed)
+        if not records:
+            return await ctx.send("No matching records.")
+        lines = []
+        for record in records:
+            summary = record["title"] or record["message"] or ""
+            if not summary and "exception" in record:
+                summary = record["exception"].strip().splitlines()[-1]
+            where = f" user {record['user']}" if record.get("user") else ""
+            where += f" guild {record['guild']}" if record.get("guild") else ""
+            lines.append(f"{record['time'][:19]} {record['level']:<8}{where} {summary}"[:200])
+        # Keep the newest records if they don't all fit
+        while len("\n".join(lines)) > 1900:
+            lines.pop(0)
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
         
 def setup(bot: Bot):
     bot.add_cog(Logging(bot))
@@ -5,15 +5,18 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import hashlib
-import json
+from array import array
 from datetime import datetime
-from random import choice, choices, gauss, randint, random, shuffle
-from typing import TYPE_CHECKING, Dict, Optional, TypeVar, Union
+from random import Random, choice, choices, randint, random
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, TypeVar, Union
 
 import discord
 from discord.ext import commands
 
 from . import utils
+from .utils import artstore
+from .utils.lazy import LazyCog
+from .utils.search import TrigramIndex
 
 if TYPE_CHECKING:
     from bot import Bot, Ctx
@@ -44,135 +47,189 @@ def to_bottom(string: str, length: int, blanks: bool = False) -> str:
         ).digest()[:length]
     )[:length] or "\U0001f97a", length=length).replace(",", ",,")
 
-def keysmash(length: int, energy: float) -> str:
-    '''No I will not elaborate'''
-    keymap_qwerty_us = [
-        "1234567890-",
-        "qwertyuiop[",
-        "asdfghjkl;'",
-        "zxcvbnm,.//", 
-        "           ", 
-        # the last slash is not accurate but it's very rarely hit so it's fine
-    ]
-    # the keysmash, on a physical keyboard, operates on the following behaviors:
-    # - wrist placement stays roughly constant
-    # - the more energy exerted, the greater distance the fingers will travel
-    # from their rest position
-    #
-    # there are four primary movements:
-    #
-    # - the "hammer", using all fingers as a single unit around their hover points.
-    # energy makes little of a difference here (the thumb may sometimes be omitted)
-    #
-    # low-energy example: asfljsd fljsd lkj;sd alkj
-    # high-energy example: as fjksdfa ljsdf ajlds fl;
-    #
-    # - the "swing", alternating between the index finger, thumb, and the other fingers 
-    # operating together as one unit (the thumb may sometimes be omitted)
-    #
-    # low-energy example: jfioewjfo; js;f djiso;f jwio;f jewiofj owi;aejf
-    # high-energy example: sfdjskf fp jioewj feqjf xoquj p0 ujt290
-    #
-    # - the "wave", a motion across the fingers propagating outwards
-    # low-energy example: fjdsakl;fj sdkl;f jsdakl
-    # high-energy example: fjdsal; fhiewo[ jfiewoj iwo jfwio
-    #
-    # - the "flop", flattening the hands around the point of contact
-    # by the joints
-    # low-energy example: asfjdkslafj,xcnad,vkjsn
-    # high-energy example: adsasdjkf.kszvkfjh.waeg,f-dk.;_nj
-    #
-    # - the "drill peck", where (usually) the index finger scatters around the keyboard
-    # low-energy example: dhssdkfjdjwif
-    # high-energy example: ajsgbei3eusjflrfolwsjdxna
-    #
-    # each of these methods may be performed with one or both hands
+# Keyboard layouts, as rows of 11 keys. The last row is the space bar.
+# The last keys of some rows are not accurate, but they are very rarely hit so it's fine
+LAYOUTS: dict[str, list[str]] = {
+    "qwerty_us": ["1234567890-", "qwertyuiop[", "asdfghjkl;'", "zxcvbnm,.//", "           "],
+    "qwertz_de": ["1234567890ß", "qwertzuiopü", "asdfghjklöä", "yxcvbnm,.--", "           "],
+    "azerty_fr": ["&é\"'(-è_çà)", "azertyuiop^", "qsdfghjklmù", "wxcvbn,;:!!", "           "],
+    "dvorak":    ["1234567890[", "',.pyfgcrl/", "aoeuidhtns-", ";qjkxbmwvzz", "           "],
+    "colemak":   ["1234567890-", "qwfpgjluy;[", "arstdhneio'", "zxcvbkm,.//", "           "],
+}
+KEYBOARD_WIDTH = 11
+# Key coordinates (x, y) are flattened to y * KEYBOARD_WIDTH + x, and mapped to characters in one translate call
+LAYOUT_TABLES = {name: dict(enumerate("".join(rows))) for name, rows in LAYOUTS.items()}
+SPACE_ROW = 4
 
-    layouts = [keymap_qwerty_us]
-    # I only implemented these because I'm boring
-    methods = [hammer, drill_peck]
+RNG = Random()
 
-    method = choice(methods)
-    layout = choice(layouts)
-    string = "".join(layout[y][x] for x, y in method(length, energy))
-    return string[:length]
+Position = tuple[int, int]
 
 _T = TypeVar("_T", bound=float)
 def minmax(n: _T, minimum: _T, maximum: _T) -> _T:
     return min(maximum, max(minimum, n))
 
-def drill_peck(length: int, energy: float) -> list[tuple[int, int]]:
-    out: list[tuple[int, int]] = []
-    right_hand = random() < 0.8
+# the keysmash, on a physical keyboard, operates on the following behaviors:
+# - wrist placement stays roughly constant
+# - the more energy exerted, the greater distance the fingers will travel
+# from their rest position
+#
+# there are five primary movements:
+#
+# - the "hammer", using all fingers as a single unit around their hover points.
+# energy makes little of a difference here (the thumb may sometimes be omitted)
+#
+# low-energy example: asfljsd fljsd lkj;sd alkj
+# high-energy example: as fjksdfa ljsdf ajlds fl;
+#
+# - the "swing", alternating between the index finger, thumb, and the other fingers 
+# operating together as one unit (the thumb may sometimes be omitted)
+#
+# low-energy example: jfioewjfo; js;f djiso;f jwio;f jewiofj owi;aejf
+# high-energy example: sfdjskf fp jioewj feqjf xoquj p0 ujt290
+#
+# - the "wave", a motion across the fingers propagating outwards
+# low-energy example: fjdsakl;fj sdkl;f jsdakl
+# high-energy example: fjdsal; fhiewo[ jfiewoj iwo jfwio
+#
+# - the "flop", flattening the hands around the point of contact
+# by the joints
+# low-energy example: asfjdkslafj,xcnad,vkjsn
+# high-energy example: adsasdjkf.kszvkfjh.waeg,f-dk.;_nj
+#
+# - the "drill peck", where (usually) the index finger scatters around the keyboard
+# low-energy example: dhssdkfjdjwif
+# high-energy example: ajsgbei3eusjflrfolwsjdxna
+#
+# each of these methods may be performed with one or both hands
+
+def hammer(length: int, _energy: float, rng: Random = RNG) -> list[Position]:
+    keys_pressed: list[tuple[float, Position]] = []
+    right_hand = rng.random() < 0.8
+    thumbless = rng.random() < 0.4
+    hands = [
+        # x, y of the thumb, index, middle, ring and pinky fingers
+        [(3, 4), (3, 2), (2, 2), (1, 2), (0, 2)],
+    ]
+    if right_hand:
+        hands.append([(6, 4), (6, 2), (7, 2), (8, 2), (9, 2)])
+    for hand, positions in enumerate(hands):
+        time = 0.0 if hand == 0 else max(0.0, rng.gauss(0.125, 0.125))
+        # Strikes of both hands interleave, so each needs to cover its share of the length
+        for _ in range(1 + length // (4 * len(hands))):
+            fingers = [0, 1, 2, 3, 4]
+            rng.shuffle(fingers)
+            for finger in fingers:
+                keys_pressed.append((time, positions[finger]))
+                time += rng.random() * 0.025
+            time += rng.gauss(0.5, 0.125)
+    keys_pressed.sort()
+    # remove consecutive spaces
+    out: list[Position] = []
+    for _, pos in keys_pressed:
+        if pos[1] == SPACE_ROW and (thumbless or out and out[-1][1] == SPACE_ROW):
+            continue
+        out.append(pos)
+    return out
+
+def swing(length: int, energy: float, rng: Random = RNG) -> list[Position]:
+    out: list[Position] = []
+    right_hand = rng.random() < 0.6
+    thumbless = rng.random() < 0.3
+    # index finger rest position, x direction towards the other fingers
+    hand_x, direction = (6, 1) if right_hand else (3, -1)
+    while len(out) < length:
+        # the index finger reaches further with more energy
+        out.append((
+            minmax(round(hand_x + rng.gauss(0, 0.5 + energy)), 0, KEYBOARD_WIDTH - 1),
+            minmax(round(rng.gauss(1.6, 0.2 + 0.6 * energy)), 0, 3),
+        ))
+        if not thumbless:
+            out.append((hand_x, SPACE_ROW))
+        # the other fingers land together, roughly in order
+        row = minmax(round(rng.gauss(1.8, 0.2 + 0.4 * energy)), 0, 3)
+        for finger in range(1, rng.randint(2, 4)):
+            out.append((minmax(hand_x + finger * direction, 0, KEYBOARD_WIDTH - 1), row))
+    return out
+
+def wave(length: int, energy: float, rng: Random = RNG) -> list[Position]:
+    out: list[Position] = []
+    both_hands = rng.random() < 0.7
+    while len(out) < length:
+        hands = [(3, -1), (6, 1)] if both_hands else [(3, -1)]
+        rng.shuffle(hands)
+        for hand_x, direction in hands:
+            # index to pinky, with rows wandering further as energy increases
+            for finger in range(4):
+                out.append((
+                    hand_x + finger * direction,
+                    minmax(round(rng.gauss(1.8, 0.2 + 0.5 * energy)), 0, 3),
+                ))
+        if rng.random() < 0.5:
+            out.append((rng.randint(3, 6), SPACE_ROW))
+    return out
+
+def flop(length: int, energy: float, rng: Random = RNG) -> list[Position]:
+    out: list[Position] = []
+    # the joints drag the point of contact down and across the keyboard
+    x, y = rng.uniform(1, 8), 2.0
+    while len(out) < length:
+        for _ in range(rng.randint(2, 5)):
+            out.append((
+                minmax(round(x + rng.gauss(0, 0.5 + energy)), 0, KEYBOARD_WIDTH - 1),
+                minmax(round(y + abs(rng.gauss(0, 0.3 + 0.5 * energy))), 0, 3),
+            ))
+        x = minmax(x + rng.gauss(0, 1.5), 0.0, KEYBOARD_WIDTH - 1.0)
+        y = minmax(y + rng.gauss(0, 0.5) * energy, 1.0, 3.0)
+    return out
+
+def drill_peck(length: int, energy: float, rng: Random = RNG) -> list[Position]:
+    out: list[Position] = []
+    right_hand = rng.random() < 0.8
     l_x, l_y = 1.5, 2
     r_x, r_y = 6.5, 2
-    for _ in range(length):
-        dx = (random() * 3 - 2) * (energy)
-        dy = (random() - 0.75) * energy
+    while len(out) < length:
+        dx = (rng.random() * 3 - 2) * (energy)
+        dy = (rng.random() - 0.75) * energy
         x, y = minmax(round(l_x + dx), 0, 9), minmax(round(l_y + dy), 0, 2)
         out.append((x, y))
         if right_hand:
-            dx = (random() * 3 - 2) * (energy)
-            dy = (random() - 0.75) * energy
+            dx = (rng.random() * 3 - 2) * (energy)
+            dy = (rng.random() - 0.75) * energy
             x, y = minmax(round(r_x + dx), 0, 9), minmax(round(r_y + dy), 0, 2)
             out.append((x, y))
     return out
 
-def hammer(length: int, _energy: float) -> list[tuple[int, int]]:
-    keys_pressed: list[tuple[float, tuple[int, int]]] = []
-    left_hand = True
-    right_hand = random() < 0.8
-    thumbless = random() < 0.4
-    if left_hand:
-        # x, y
-        positions = [
-            (3, 4), (3, 2), (2, 2), (1, 2), (0, 2)
-        ]
-        time = 0
-        for _ in range(1 + length // 4):
-            fingers = [0, 1, 2, 3, 4]
-            shuffle(fingers)
-            for finger in fingers:
-                keys_pressed.append((time, positions[finger]))
-                time += random() * 0.025
-            time += gauss(0.5, 0.125)   
-    if right_hand:
-        # x, y
-        time = max(0.0, gauss(0.125, 0.125))
-        positions = [
-            (6, 4), (6, 2), (7, 2), (8, 2), (9, 2)
-        ]
-        for _ in range(1 + length // 4):
-            fingers = [0, 1, 2, 3, 4]
-            shuffle(fingers)
-            for finger in fingers:
-                keys_pressed.append((time, positions[finger]))
-                time += random() * 0.025
-            time += gauss(0.5, 0.125)
-    keys_pressed.sort()
-    # remove consecutive spaces
-    last = (-1, -1)
-    for i, (_, pos) in enumerate(keys_pressed):
-        if last[1] == 4 and pos[1] == 4:
-            del keys_pressed[i]
-        last = pos
+GESTURES = (hammer, swing, wave, flop, drill_peck)
+
+def keysmashes(lengths: Iterable[int], energy: float, *, rng: Random = RNG, layout: str = "qwerty_us") -> list[str]:
+    '''Many keysmashes by the same person, on the same keyboard'''
+    keys = array("B")
+    bounds: list[tuple[int, int]] = []
+    for length in lengths:
+        positions = rng.choice(GESTURES)(length, energy, rng)[:length]
+        bounds.append((len(keys), len(keys) + len(positions)))
+        keys.extend(y * KEYBOARD_WIDTH + x for x, y in positions)
+    # Every key is mapped to its character at once
+    string = keys.tobytes().decode("latin-1").translate(LAYOUT_TABLES[layout])
+    return [string[start:end] for start, end in bounds]
 
-    if thumbless:
-        return [pos for _, pos in keys_pressed if pos[1] != 4]
-    else:
-        return [pos for _, pos in keys_pressed]
+def keysmash(length: int, energy: float, *, rng: Random = RNG, layout: str = "qwerty_us") -> str:
+    '''No I will not elaborate'''
+    return keysmashes([length], energy, rng=rng, layout=layout)[0]
 
-class Shell(commands.Cog):
+class Shell(LazyCog):
     '''Assorted shell commands'''
 
     def __init__(self, bot: Bot):
+        super().__init__()
         self.bot = bot
         
-        # Neofetch data
-        with open("data/icons.json") as fp:
-            self.distros: Dict[str, str] = json.load(fp)
-        self.distro_names = [*self.distros.keys()]
-        self.lower_distros = {d.lower(): d for d in self.distro_names}
+        # Neofetch data, loaded by lazy_init
+        self.distros: artstore.ArtStore = None # type: ignore
+        self.distro_names: list[str] = []
+        self.lower_distros: Dict[str, str] = {}
+        self.distro_index: TrigramIndex[str] = None # type: ignore
         self.instruction_sets = (
             "6502","6809","680x0","8080","8051",
             "x86","x86_64","Alpha","ARC","ARM",
@@ -217,6 +274,16 @@ class Shell(commands.Cog):
             "Quartz Compositor","No WM Necessary"
         )
 
+    def cog_unload(self):
+        if self.initialized:
+            self.distros.close()
+
+    def lazy_init(self):
+        self.distros = artstore.load("data/icons.bin", "data/icons.json")
+        self.distro_names = self.distros.names
+        self.lower_distros = {d.lower(): d for d in self.distro_names}
+        self.distro_index = TrigramIndex((d, d) for d in self.distro_names)
+
     @commands.command()
     async def neofetch(self, ctx: Ctx, *, distro: Optional[str] = None):
         '''Shows the user's system information.'''
@@ -226,12 +293,13 @@ class Shell(commands.Cog):
             title = f"{ctx.author.display_name} @ Direct Message"
         if distro is None:
             distro_name = choice(self.distro_names)
-        elif distro not in self.lower_distros:
+        elif distro.lower() in self.lower_distros:
+            distro_name = self.lower_distros[distro.lower()]
+        else:
+            suggestions = ", ".join(f"`{name}`" for _, name in self.distro_index.search(distro, limit=3))
             return await ctx.boom(
-                f"Distro `{distro}` not found."
+                f"Distro `{distro}` not found." + (f" Did you mean {suggestions}?" if suggestions else "")
             )
-        else:
-            distro_name = self.lower_distros[distro]
         pacmans = set(choices(self.package_managers, k=randint(1, 3)))
         if ctx.guild:
             host = "Host: " + ctx.guild.name
@@ -256,7 +324,7 @@ class Shell(commands.Cog):
         # worse.
         embed = discord.Embed(color=ctx.color, description= "\n".join([
             "```",
-            self.distros[distro_name].replace("`", "\u200b`"),
+            self.distros[distro_name],
             "```",
             "```diff",
             *fields,
@@ -303,10 +371,9 @@ class Shell(commands.Cog):
         energy = 1.0 - 0.4 ** (count + 1)
         uptime = to_bottom(str(random()), 5)
         load = to_bottom(str(random()), 6)
-        tasks = keysmash(44, energy)
-        cpus = keysmash(42, energy)
-        mems = keysmash(42, energy)
-        swap = keysmash(41, energy)
+        smashes = keysmashes([44, 42, 42, 41, 4, 5, 6, *(7, 8, 9, 10) * 20], energy)
+        tasks, cpus, mems, swap = smashes[:4]
+        users, commands = smashes[4:7], smashes[7:]
         out = [
             "```",
             f"bottom - up {uptime}, load average: {load}",
@@ -317,8 +384,6 @@ class Shell(commands.Cog):
             "",
             "   PID    USER    %CPU    %MEM    TIME     COMMAND"
         ]
-        users = [keysmash(x, energy) for x in (4, 5, 6)]
-        commands = [keysmash(x, energy) for x in (7, 8, 9, 10) * 20]
         for _ in range(10):
             out.append(
                 f"{to_bottom(str(randint(0, 200000)), 3, True)}  "
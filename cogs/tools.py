@@ -2,19 +2,184 @@
 
 from __future__ import annotations
 
+import asyncio
+import functools
 import re
 import string
+import sys
 import unicodedata
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import discord
 from discord.ext import commands
+from discord.ext import menus # type: ignore
+
+from .utils import emoji
+from .utils.search import TrigramIndex
 
 if TYPE_CHECKING:
     from bot import Bot, Ctx
 else:
     Ctx = commands.Context
 
+# Names derived from the code point, which would only crowd out real results
+ALGORITHMIC_NAMES = (
+    "CJK UNIFIED IDEOGRAPH-",
+    "CJK COMPATIBILITY IDEOGRAPH-",
+    "HANGUL SYLLABLE ",
+    "TANGUT IDEOGRAPH-",
+    "KHITAN SMALL SCRIPT CHARACTER-",
+    "NUSHU CHARACTER-",
+)
+
+def unicode_names() -> Iterator[tuple[str, int]]:
+    '''Yields the name and code point of every named character with a non-algorithmic name'''
+    for point in range(sys.maxunicode + 1):
+        name = unicodedata.name(chr(point), None)
+        if name is not None and not name.startswith(ALGORITHMIC_NAMES):
+            yield name, point
+
+CUSTOM_EMOJI_REGEX = re.compile(r"<a?:[a-zA-Z0-9_]{2,32}:[0-9]{18,22}>")
+# Discord's limit of distinct reactions on a message
+MAX_REACTIONS = 20
+
+def parse_poll(msg: str, keycaps: dict[str, str], trie: emoji.EmojiTrie) -> list[str]:
+    '''Returns the reactions for the lines of a poll that start with emoji, in order and without duplicates'''
+    reactions: list[str] = []
+    for line in msg.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        # numbers and letters are cool
+        shorthand = line.split(None, 1)[0].removesuffix(":").lower()
+        if shorthand in keycaps:
+            reaction = keycaps[shorthand]
+        elif (match := CUSTOM_EMOJI_REGEX.match(line)) is not None:
+            reaction = match[0]
+        else:
+            reaction = trie.match(line)
+        if reaction is not None and reaction not in reactions:
+            reactions.append(reaction)
+    return reactions[:MAX_REACTIONS]
+
+ZWJ = "\u200d"
+
+def extends_cluster(char: str) -> bool:
+    '''Whether a character never starts a grapheme cluster of its own'''
+    point = ord(char)
+    return (
+        unicodedata.category(char) in ("Mn", "Me", "Mc") # combining marks, including variation selectors
+        or char == ZWJ
+        or 0x1F3FB <= point <= 0x1F3FF # emoji skin tone modifiers
+        or 0xE0020 <= point <= 0xE007F # emoji tag sequences
+    )
+
+def graphemes(text: str) -> Iterator[str]:
+    '''Splits a string into grapheme clusters.
+
+    This is a simplification of UAX #29, enough to keep combining sequences, emoji
+    ZWJ sequences, modifiers and flags together. Hangul jamo and prepend characters
+    are not treated specially.
+    '''
+    start = 0
+    regional = 0 # Regional indicators in the current cluster, which pair up into flags
+    for i, char in enumerate(text):
+        previous = text[i - 1] if i else ""
+        is_regional = 0x1F1E6 <= ord(char) <= 0x1F1FF
+        if i == 0:
+            pass
+        elif extends_cluster(char) or previous == ZWJ or previous + char == "\r\n":
+            continue
+        elif is_regional and regional % 2 == 1 and i - start == regional:
+            regional += 1
+            continue
+        else:
+            yield text[start:i]
+            start = i
+            regional = 0
+        regional += is_regional
+    if text:
+        yield text[start:]
+
+@functools.lru_cache(maxsize=4096)
+def describe(char: str) -> tuple[str, str]:
+    '''Returns the escape sequence and name of a character'''
+    num = f"{ord(char):x}"
+    if len(num) <= 2:
+        escape = f"\\x{num:0>2}"
+    elif len(num) <= 4:
+        escape = f"\\u{num:0>4}"
+    else:
+        escape = f"\\U{num:0>8}"
+    return escape, unicodedata.name(char, "<name missing>").upper()
+
+class CharsSource(menus.ListPageSource):
+    '''Character info, formatted a page at a time.
+
+    Entries are `(cluster, None)` for the header of a multi-character cluster,
+    and `(char, nested)` for each character. They are split into pages of at
+    most `max_length` characters, page number included.
+    '''
+    # Longest grapheme cluster shown in full in a header
+    MAX_CLUSTER = 32
+    # Narrowest escape column
+    MIN_WIDTH = 4
+    # Backticks, colon and spaces around the escape, character and name of a line
+    LINE_DECORATION = 9
+
+    def __init__(self, text: str, *, max_length: int = 2000):
+        entries: list[tuple[str, Optional[bool]]] = []
+        for cluster in graphemes(text):
+            if len(cluster) == 1:
+                entries.append((cluster, False))
+            else:
+                entries.append((cluster, None))
+                entries.extend((char, True) for char in cluster)
+        # Escapes are padded to the widest one on their page, so a page is as long as
+        # its unpadded lines plus that width for each of the lines with an escape.
+        # Lines are measured without being formatted, which only the shown page is.
+        footer = len(f"`Page {len(entries)}/{len(entries)}`")
+        pages: list[list[tuple[str, Optional[bool]]]] = []
+        page: list[tuple[str, Optional[bool]]] = []
+        length, escapes, width = footer, 0, self.MIN_WIDTH
+        for entry in entries:
+            text, nested = entry
+            if nested is None:
+                unpadded, escape = len(self.header(text)) + 1, 0
+            else:
+                point = ord(text)
+                escape = 4 if point <= 0xFF else 6 if point <= 0xFFFF else 10
+                name = unicodedata.name(text, "<name missing>")
+                unpadded = 2 * nested + self.LINE_DECORATION + len(text) + len(name) + 1
+            if page and length + unpadded + (escapes + bool(escape)) * max(width, escape) > max_length:
+                pages.append(page)
+                page, length, escapes, width = [], footer, 0, self.MIN_WIDTH
+            page.append(entry)
+            length += unpadded
+            escapes += bool(escape)
+            width = max(width, escape)
+        if page:
+            pages.append(page)
+        super().__init__(pages, per_page=1)
+
+    def header(self, cluster: str) -> str:
+        shown = cluster[:self.MAX_CLUSTER] + ("…" if len(cluster) > self.MAX_CLUSTER else "")
+        return f"`{shown}`:"
+
+    def line(self, char: str, nested: bool, width: int) -> str:
+        escape, name = describe(char)
+        return f"{'└ ' if nested else ''}`{escape: <{width}}`: `{char}` `{name}`"
+
+    async def format_page(self, menu: menus.MenuPages, page: list[tuple[str, Optional[bool]]]):
+        width = max([self.MIN_WIDTH, *(len(describe(text)[0]) for text, nested in page if nested is not None)])
+        lines = [
+            self.header(text) if nested is None else self.line(text, nested, width)
+            for text, nested in page
+        ]
+        if self.is_paginating():
+            lines.append(f"`Page {menu.current_page + 1}/{self.get_max_pages()}`")
+        return "\n".join(lines)
+
 class Tools(commands.Cog):
     """Convenience commands designed to be unobtrusive"""
 
@@ -22,6 +187,10 @@ class Tools(commands.Cog):
         self.bot = bot
         self.keycaps: dict[str, str] = {}
         self.define_keycaps()
+        self.emoji = emoji.load("data/emoji.txt")
+        # Built on first use, as it takes about a second
+        self.unicode_index: Optional[TrigramIndex[int]] = None
+        self.unicode_lock = asyncio.Lock()
 
     def define_keycaps(self):
         '''Adds some shorthands for keycaps'''
@@ -54,66 +223,45 @@ class Tools(commands.Cog):
         This is *not* an overengineered poll command with embeds and timeouts and whatever.
         It just adds reactions. (Okay, it's a little overengineered.)
         '''
-        # This determines if a line starts with emoji.
-        #
-        # Custom emoji are easy to parse out.
-        # 
-        # Instead of using a stupid and unmaintainable unicode emoji regex, 
-        # this uses heuristics and Discord 400s to parse built-in emoji.
-        custom_emoji_regex = re.compile(r"<a?:[a-zA-Z0-9_]{2,32}:[0-9]{18,22}>")
-        definitely_not_emoji_regex = re.compile(r"[\x21-\x3B\x3D\x3F-\x7E]")
-        lines = [line.split(None, 1)[0] for line in msg.splitlines() if line and not line.isspace()]
-        for maybe_emoji in lines:
-            # numbers and letters are cool
-            try:
-                shorthand = maybe_emoji.removesuffix(":").strip().lower()
-                await ctx.message.add_reaction(self.keycaps[shorthand])
-            except KeyError as e:
-                pass
-            # An incomplete match is enough to rule this out
-            if definitely_not_emoji_regex.match(maybe_emoji) is not None:
-                continue
-            # This is definitely a custom emoji
-            if custom_emoji_regex.match(maybe_emoji) is not None:
-                try:
-                    await ctx.message.add_reaction(maybe_emoji)
-                except discord.Forbidden:
-                    return await ctx.send(f"I can't react with {maybe_emoji}")
-                except discord.HTTPException as exc:
-                    if exc.status == 400:
-                        return await ctx.boom(f"I have no access to {maybe_emoji}")
-            # This *could* be a unicode emoji, but we'll have to check to be sure
-            else:
-                try:
-                    await ctx.message.add_reaction(maybe_emoji)
-                except discord.Forbidden:
-                    return await ctx.send(f"I can't react with {maybe_emoji}")
-                # Not valid
-                except discord.HTTPException:
-                    pass
+        # Emoji are recognized offline, so only valid reactions are ever sent.
+        # Custom emoji may still be inaccessible to the bot.
+        reactions = parse_poll(msg, self.keycaps, self.emoji)
+        # Reactions share a rate limit bucket, on which the HTTP client queues them in order
+        results = await asyncio.gather(
+            *(ctx.message.add_reaction(reaction) for reaction in reactions),
+            return_exceptions=True
+        )
+        for reaction, result in zip(reactions, results):
+            if isinstance(result, discord.Forbidden):
+                return await ctx.send(f"I can't react with {reaction}")
+            elif isinstance(result, discord.HTTPException):
+                # Unicode emoji newer than Discord's are not worth mentioning
+                if result.status == 400 and CUSTOM_EMOJI_REGEX.match(reaction) is not None:
+                    return await ctx.boom(f"I have no access to {reaction}")
+            elif isinstance(result, BaseException):
+                raise result
     
     @commands.command(aliases=["charinfo", "char"])
     async def chars(self, ctx: Ctx, *, string: str):
-        '''Return character info for a string'''
-        out = []
-        width = 4
-        for c in string:
-            num = f"{ord(c):x}"
-            if len(num) <= 2:
-                escape = f"\\x{num:0>2}"
-            elif len(num) <= 4:
-                escape = f"\\u{num:0>4}"
-                width = max(width, 6)
-            else:
-                escape = f"\\U{num:0>8}"
-                width = max(width, 10)
-            name = unicodedata.name(c, "<name missing>")
-            out.append(f"`{escape: <{width}}`: `{c}` `{name.upper()}`")
-        
-        result = "\n".join(out)
-        if len(result) > 2000:
-            return await ctx.boom("Result too long")
-        await ctx.send(result)
+        '''Return character info for a string, grouped by grapheme cluster'''
+        menu = menus.MenuPages(source=CharsSource(string), clear_reactions_after=True)
+        await menu.start(ctx)
+
+    @commands.command(aliases=["uniname", "charsearch"])
+    async def unicode(self, ctx: Ctx, *, name: str):
+        '''Finds characters by (part of) their Unicode name'''
+        async with self.unicode_lock:
+            if self.unicode_index is None:
+                async with ctx.typing():
+                    self.unicode_index = await self.bot.loop.run_in_executor(
+                        None, lambda: TrigramIndex(unicode_names())
+                    )
+        results = self.unicode_index.search(name, limit=15)
+        if not results:
+            return await ctx.boom(f"No characters found for `{name}`")
+        await ctx.send("\n".join(
+            f"`U+{point:0>4X}`: `{chr(point)}` `{key.upper()}`" for key, point in results
+        ))
 
 def setup(bot: Bot):
     bot.add_cog(Tools(bot))
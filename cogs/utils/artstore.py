@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+'''
+A compact, indexed file of ASCII art, read through a memory map.
+
+The file consists of a header, an index of names with the offsets and lengths
+of their arts, and the UTF-8 encoded arts themselves. Arts are stored ready to
+be placed inside a code block.
+'''
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b"ARTS"
+VERSION = 1
+# magic, version, entry count
+HEADER = struct.Struct("<4sHI")
+# name length, then the name, then ENTRY
+NAME_LENGTH = struct.Struct("<H")
+# offset into the data section, art length
+ENTRY = struct.Struct("<II")
+
+def sanitize(art: str) -> str:
+    '''Prevents backticks in the art from closing the code block.'''
+    return art.replace("`", "\u200b`")
+
+def build(arts: dict[str, str], path: str):
+    '''Writes `arts` to a new art file at `path`.'''
+    index = bytearray(HEADER.pack(MAGIC, VERSION, len(arts)))
+    data = bytearray()
+    for name, art in arts.items():
+        encoded_name = name.encode("utf-8")
+        encoded_art = sanitize(art).encode("utf-8")
+        index += NAME_LENGTH.pack(len(encoded_name)) + encoded_name
+        index += ENTRY.pack(len(data), len(encoded_art))
+        data += encoded_art
+    # Replaced atomically, since the previous file may be mapped
+    with open(path + ".tmp", "wb") as fp:
+        fp.write(index)
+        fp.write(data)
+    os.replace(path + ".tmp", path)
+
+class ArtStore:
+    '''Read-only access to an art file. Only the index is kept in memory.'''
+    def __init__(self, path: str):
+        with open(path, "rb") as fp:
+            self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} art file")
+        position = HEADER.size
+        entries: list[tuple[str, int, int]] = []
+        for _ in range(count):
+            (name_length,) = NAME_LENGTH.unpack_from(self.map, position)
+            position += NAME_LENGTH.size
+            name = self.map[position:position + name_length].decode("utf-8")
+            position += name_length
+            offset, length = ENTRY.unpack_from(self.map, position)
+            position += ENTRY.size
+            entries.append((name, offset, length))
+        # Data offsets are relative to the end of the index
+        self.index = {name: (position + offset, length) for name, offset, length in entries}
+        self.names = [*self.index]
+
+    def __getitem__(self, name: str) -> str:
+        offset, length = self.index[name]
+        return self.map[offset:offset + length].decode("utf-8")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self):
+        self.map.close()
+
+def load(path: str, source: str) -> ArtStore:
+    '''Opens the art file at `path`, (re)building it from the JSON at `source` if missing or outdated.'''
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        with open(source, encoding="utf-8") as fp:
+            build(json.load(fp), path)
+    return ArtStore(path)
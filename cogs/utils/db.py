@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+'''
+Database schema migrations and connection pooling.
+
+The schema version is kept in `PRAGMA user_version`. Each entry of `MIGRATIONS`
+upgrades the schema by one version, and is either an SQL script or a function
+taking a `sqlite3.Connection`. Migrations only ever get appended.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import sqlite3
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+import asqlite
+
+def _add_dm_channel(conn: sqlite3.Connection):
+    # The column may predate this migration
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users);")}
+    if "dm_channel" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN dm_channel INTEGER;")
+
+MIGRATIONS: list[Union[str, Callable[[sqlite3.Connection], None]]] = [
+    # 1: Core tables. These existed before migrations did, hence IF NOT EXISTS
+    '''
+    CREATE TABLE IF NOT EXISTS stats (
+        last_xkcd INTEGER NOT NULL
+    );
+    INSERT INTO stats (last_xkcd) SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM stats);
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        xkcd_remind INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0
+    );
+    ''',
+    # 2: XKCD comic cache and archive backfill
+    '''
+    CREATE TABLE IF NOT EXISTS xkcd_comics (
+        num INTEGER PRIMARY KEY,
+        safe_title TEXT NOT NULL,
+        alt TEXT NOT NULL,
+        transcript TEXT NOT NULL DEFAULT '',
+        img TEXT NOT NULL,
+        year TEXT NOT NULL,
+        month TEXT NOT NULL,
+        day TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS xkcd_missing (
+        num INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS xkcd_backfill (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        next INTEGER NOT NULL,
+        running INTEGER NOT NULL
+    );
+    ''',
+    # 3: XKCD full-text search, kept in sync with xkcd_comics by triggers
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS xkcd_search USING fts5(
+        safe_title, alt, transcript,
+        content = 'xkcd_comics',
+        content_rowid = 'num'
+    );
+    CREATE TRIGGER IF NOT EXISTS xkcd_search_insert AFTER INSERT ON xkcd_comics BEGIN
+        INSERT INTO xkcd_search (rowid, safe_title, alt, transcript)
+        VALUES (new.num, new.safe_title, new.alt, new.transcript);
+    END;
+    CREATE TRIGGER IF NOT EXISTS xkcd_search_delete AFTER DELETE ON xkcd_comics BEGIN
+        INSERT INTO xkcd_search (xkcd_search, rowid, safe_title, alt, transcript)
+        VALUES ('delete', old.num, old.safe_title, old.alt, old.transcript);
+    END;
+    CREATE TRIGGER IF NOT EXISTS xkcd_search_update AFTER UPDATE ON xkcd_comics BEGIN
+        INSERT INTO xkcd_search (xkcd_search, rowid, safe_title, alt, transcript)
+        VALUES ('delete', old.num, old.safe_title, old.alt, old.transcript);
+        INSERT INTO xkcd_search (rowid, safe_title, alt, transcript)
+        VALUES (new.num, new.safe_title, new.alt, new.transcript);
+    END;
+    INSERT INTO xkcd_search (xkcd_search) VALUES ('rebuild');
+    ''',
+    # 4: Cached DM channels for XKCD notifications
+    _add_dm_channel,
+    # 5: Comics the archive backfill gave up on
+    '''
+    CREATE TABLE IF NOT EXISTS xkcd_failed (
+        num INTEGER PRIMARY KEY,
+        error TEXT NOT NULL
+    );
+    ''',
+]
+
+def migrate(path: str) -> int:
+    '''Upgrades the database at `path` to the latest schema version, and returns that version.'''
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL;")
+        version: int = conn.execute("PRAGMA user_version;").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Each migration and its version bump are applied atomically
+            try:
+                if callable(migration):
+                    conn.execute("BEGIN;")
+                    migration(conn)
+                    conn.execute(f"PRAGMA user_version = {number};")
+                    conn.execute("COMMIT;")
+                else:
+                    conn.executescript(f"BEGIN;\n{migration}\nPRAGMA user_version = {number};\nCOMMIT;")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK;")
+                raise
+        return len(MIGRATIONS)
+    finally:
+        conn.close()
+
+class Database:
+    '''A WAL-mode SQLite database with a pool of read-only connections and one writer.
+
+    Writes are serialized through the writer, while reads run on the reader pool
+    and don't queue behind them. The writer methods mirror `asqlite.Connection`,
+    and each holds the writer until it is done, so that no statement lands inside
+    another coroutine's transaction. `report` is awaited with the errors of
+    background writes.
+    '''
+    def __init__(
+        self,
+        writer: asqlite.Connection,
+        readers: list[asqlite.Connection],
+        *,
+        report: Optional[Callable[[BaseException], Awaitable[None]]] = None,
+    ):
+        self.writer = writer
+        self.write_lock = asyncio.Lock()
+        self.all_readers = readers
+        self.readers: asyncio.Queue[asqlite.Connection] = asyncio.Queue()
+        for reader in readers:
+            self.readers.put_nowait(reader)
+        self.users = UserWrites(self, report=report)
+
+    @classmethod
+    async def connect(
+        cls,
+        path: str,
+        *,
+        readers: int = 3,
+        report: Optional[Callable[[BaseException], Awaitable[None]]] = None,
+    ) -> Database:
+        '''Migrates the database to the latest schema, then opens the connections.'''
+        await asyncio.get_running_loop().run_in_executor(None, migrate, path)
+        writer = await asqlite.connect(path)
+        await writer.execute("PRAGMA synchronous = NORMAL;")
+        pool = []
+        for _ in range(readers):
+            reader = await asqlite.connect(path)
+            await reader.execute("PRAGMA query_only = ON;")
+            pool.append(reader)
+        return cls(writer, pool, report=report)
+
+    async def close(self):
+        '''Commits the buffered user updates and closes the connections, even if committing fails.'''
+        try:
+            await self.users.flush()
+        finally:
+            for reader in self.all_readers:
+                await reader.close()
+            async with self.write_lock:
+                await self.writer.close()
+
+    @contextlib.asynccontextmanager
+    async def reader(self) -> AsyncIterator[asqlite.Connection]:
+        '''Borrows a read-only connection from the pool.'''
+        conn = await self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+
+    async def fetchone(self, query: str, *parameters):
+        async with self.reader() as conn:
+            return await conn.fetchone(query, *parameters)
+
+    async def fetchall(self, query: str, *parameters):
+        async with self.reader() as conn:
+            return await conn.fetchall(query, *parameters)
+
+    async def execute(self, sql: str, *parameters):
+        async with self.write_lock:
+            return await self.writer.execute(sql, *parameters)
+
+    async def executemany(self, sql: str, seq_of_parameters):
+        async with self.write_lock:
+            return await self.writer.executemany(sql, seq_of_parameters)
+
+    @contextlib.asynccontextmanager
+    async def cursor(self) -> AsyncIterator[asqlite.Cursor]:
+        async with self.write_lock:
+            async with self.writer.cursor() as cur:
+                yield cur
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[asqlite.Connection]:
+        '''Runs a transaction on the writer, holding it until the transaction ends.
+
+        Statements in the transaction must go through the yielded connection,
+        since the other writer methods wait for the transaction to end.
+        '''
+        async with self.write_lock:
+            async with self.writer.transaction():
+                yield self.writer
+
+class UserWrites:
+    '''A write-behind buffer for the `users` table.
+
+    Updates are merged per user and committed together in one transaction,
+    at most `interval` seconds after the first of them. Pending values must be
+    consulted through `get` until then. Failed background flushes are passed to
+    `report`, and retried with exponential backoff, keeping the updates pending.
+    '''
+    COLUMNS = frozenset({"xkcd_remind", "blocked", "dm_channel"})
+    MAX_BACKOFF = 300.0
+
+    def __init__(
+        self,
+        db: Database,
+        *,
+        interval: float = 2.0,
+        report: Optional[Callable[[BaseException], Awaitable[None]]] = None,
+    ):
+        self.db = db
+        self.interval = interval
+        self.report = report
+        self.failures = 0
+        self.pending: dict[int, dict[str, int]] = {}
+        # Updates taken out of `pending` but not yet committed
+        self.flushing: dict[int, dict[str, int]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    def update(self, user: int, **columns: int):
+        '''Schedules an update to a user's row, creating it if needed.'''
+        unknown = columns.keys() - self.COLUMNS
+        if unknown:
+            raise ValueError(f"Unknown users columns: {', '.join(unknown)}")
+        self.pending.setdefault(user, {}).update(columns)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.flush_later())
+
+    def get(self, user: int, column: str) -> Optional[int]:
+        '''Returns the value of a column that is yet to be committed, if any.'''
+        for updates in (self.pending, self.flushing):
+            if column in updates.get(user, ()):
+                return updates[user][column]
+        return None
+
+    async def flush_later(self):
+        await asyncio.sleep(min(self.interval * 2 ** self.failures, self.MAX_BACKOFF))
+        # Updates made while this flush commits schedule a flush of their own
+        self.task = None
+        try:
+            await self.flush()
+        except Exception as exc:
+            self.failures += 1
+            if self.task is None:
+                self.task = asyncio.get_running_loop().create_task(self.flush_later())
+            if self.report is not None:
+                await self.report(exc)
+        else:
+            self.failures = 0
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            # Rows updating the same columns share a statement
+            groups: defaultdict[tuple[str, ...], list[tuple[int, ...]]] = defaultdict(list)
+            for user, updates in self.flushing.items():
+                columns = tuple(sorted(updates))
+                groups[columns].append((user, *(updates[column] for column in columns)))
+            try:
+                async with self.db.transaction() as conn:
+                    for columns, rows in groups.items():
+                        await conn.executemany(
+                            f'''
+                            INSERT INTO users (id, {", ".join(columns)})
+                            VALUES (?{", ?" * len(columns)})
+                            ON CONFLICT(id) DO UPDATE
+                            SET {", ".join(f"{column} = excluded.{column}" for column in columns)};
+                            ''',
+                            rows
+                        )
+            except BaseException:
+                # Retry with the next flush, without clobbering newer updates
+                for user, updates in self.flushing.items():
+                    self.pending[user] = {**updates, **self.pending.get(user, {})}
+                raise
+            finally:
+                self.flushing = {}
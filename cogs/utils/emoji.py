@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+'''
+Offline recognition of Unicode emoji sequences.
+'''
+
+from __future__ import annotations
+
+from typing import Any, Iterable, Optional
+
+VS16 = "\ufe0f"
+# Key under which a trie node stores the emoji ending there
+END = ""
+
+class EmojiTrie:
+    '''A trie of emoji sequences, for finding the emoji at the start of a string.
+
+    Emoji presentation selectors (U+FE0F) are ignored when matching, so that
+    unqualified and minimally-qualified emoji are recognized too. Matches are
+    returned in their fully-qualified form, which is what Discord accepts.
+    '''
+    def __init__(self, sequences: Iterable[str]):
+        self.root: dict[str, Any] = {}
+        for sequence in sequences:
+            node = self.root
+            for char in sequence.replace(VS16, ""):
+                node = node.setdefault(char, {})
+            # Prefer the fully-qualified form if several normalize the same
+            if END not in node or VS16 in sequence:
+                node[END] = sequence
+
+    def match(self, text: str) -> Optional[str]:
+        '''Returns the longest emoji that `text` starts with, if any.'''
+        node = self.root
+        longest = None
+        for char in text:
+            if char == VS16:
+                continue
+            if char not in node:
+                break
+            node = node[char]
+            longest = node.get(END, longest)
+        return longest
+
+def load(path: str) -> EmojiTrie:
+    '''Loads emoji sequences from a file of space-separated hexadecimal code points, one sequence per line.'''
+    with open(path, encoding="utf-8") as fp:
+        return EmojiTrie(
+            "".join(chr(int(point, 16)) for point in line.split())
+            for line in fp
+            if line.strip() and not line.startswith("#")
+        )
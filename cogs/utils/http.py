@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+A shared HTTP client for network-backed cogs.
+
+Wraps a single `aiohttp.ClientSession` with per-host connection limits,
+default timeouts, retries, an opt-in TTL response cache, coalescing of
+identical in-flight GETs and per-host metrics.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Mapping, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+class Response:
+    '''A fully read HTTP response. Safe to share between callers and to cache.'''
+    __slots__ = ("url", "status", "headers", "body")
+
+    def __init__(self, url: str, status: int, headers: Mapping[str, str], body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding)
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+class HostStats:
+    '''Request metrics for a single host.'''
+    # Number of recent latencies kept for percentiles
+    WINDOW = 256
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.latencies: deque[float] = deque(maxlen=self.WINDOW)
+
+    def percentile(self, q: float) -> float:
+        '''Returns the `q`th quantile of recent latencies, in seconds.'''
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class HTTPClient:
+    '''An instrumented, caching HTTP client.'''
+    # Statuses worth retrying, the base of the exponential backoff, and the
+    # longest Retry-After worth waiting for (seconds)
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    RETRY_BACKOFF = 0.5
+    MAX_RETRY_AFTER = 30.0
+
+    def __init__(
+        self,
+        *,
+        limit_per_host: int = 8,
+        timeout: float = 15.0,
+        retries: int = 2,
+        cache_size: int = 256,
+    ):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+        self.retries = retries
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple, tuple[float, Response]] = OrderedDict()
+        self.inflight: dict[tuple, asyncio.Task[Response]] = {}
+        self.stats: dict[str, HostStats] = {}
+
+    async def close(self):
+        await self.session.close()
+
+    def host_stats(self, url: str) -> HostStats:
+        host = urlsplit(url).netloc
+        if host not in self.stats:
+            self.stats[host] = HostStats()
+        return self.stats[host]
+
+    async def get(
+        self,
+        url: str,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        ttl: Optional[float] = None,
+        refresh: bool = False,
+    ) -> Response:
+        '''Performs a GET request.
+
+        Identical requests already in flight share a single response.
+        If `ttl` is given, successful responses are cached for that many seconds.
+        With `refresh`, a cached response is replaced instead of returned.
+        '''
+        key = (url, tuple(sorted((headers or {}).items())))
+        stats = self.host_stats(url)
+        if ttl is not None and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                expires, response = cached
+                if time.monotonic() < expires:
+                    self.cache.move_to_end(key)
+                    stats.cache_hits += 1
+                    return response
+                del self.cache[key]
+
+        # The request runs in its own task, so that a cancelled caller doesn't
+        # cancel it for the others waiting on the same response
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.fetch(key, url, headers, ttl))
+            self.inflight[key] = task
+            task.add_done_callback(lambda task: self.finish(key, task))
+        else:
+            stats.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def fetch(self, key: tuple, url: str, headers: Optional[dict[str, str]], ttl: Optional[float]) -> Response:
+        response = await self.request("GET", url, headers=headers)
+        if ttl is not None and response.status == 200:
+            self.cache[key] = (time.monotonic() + ttl, response)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return response
+
+    def finish(self, key: tuple, task: asyncio.Task[Response]):
+        del self.inflight[key]
+        # Retrieve the exception so that failures nobody waited for aren't reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    async def request(self, method: str, url: str, **kwargs) -> Response:
+        '''Performs a request, retrying on connection errors and transient statuses.'''
+        stats = self.host_stats(url)
+        attempt = 0
+        while True:
+            stats.requests += 1
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    response = Response(url, resp.status, resp.headers, await resp.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                stats.errors += 1
+                if attempt == self.retries:
+                    raise
+                delay = self.RETRY_BACKOFF * 2 ** attempt
+            else:
+                if response.status not in self.RETRY_STATUSES:
+                    return response
+                stats.errors += 1
+                if attempt == self.retries:
+                    return response
+                delay = self.RETRY_BACKOFF * 2 ** attempt
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    if float(retry_after) > self.MAX_RETRY_AFTER:
+                        return response
+                    delay = max(delay, float(retry_after))
+            finally:
+                stats.latencies.append(time.perf_counter() - start)
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+'''
+Deferred initialization for cogs with expensive setup.
+'''
+
+from __future__ import annotations
+
+import asyncio
+
+from discord.ext import commands
+
+class LazyCog(commands.Cog):
+    '''A cog whose heavy initialization is deferred until the first invocation of one of its commands.
+
+    Subclasses implement `lazy_init`, which is run once in an executor so that
+    it blocks neither startup nor the event loop. Subclasses overriding
+    `cog_before_invoke` must call this one.
+    '''
+    def __init__(self):
+        self.initialized = False
+        self.init_lock = asyncio.Lock()
+
+    def lazy_init(self):
+        raise NotImplementedError
+
+    async def ensure_initialized(self):
+        if self.initialized:
+            return
+        async with self.init_lock:
+            if not self.initialized:
+                await asyncio.get_running_loop().run_in_executor(None, self.lazy_init)
+                self.initialized = True
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        await self.ensure_initialized()
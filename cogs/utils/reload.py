@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+'''
+Helpers for incremental extension reloads.
+'''
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import sys
+
+def source_hash(name: str) -> str:
+    '''Returns a digest of the source file of the module `name`.'''
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    with open(spec.origin, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+def validate_extension(name: str):
+    '''Executes a fresh copy of the extension `name` without installing it, raising on failure.
+
+    The live module is restored before this returns, so nothing can observe the copy.
+    '''
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    module = importlib.util.module_from_spec(spec)
+    live = sys.modules.get(name)
+    # Some machinery (e.g. typing and dataclasses) looks the module up by name while executing
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        if live is None:
+            del sys.modules[name]
+        else:
+            sys.modules[name] = live
+    if not hasattr(module, "setup"):
+        raise AttributeError(f"Extension {name!r} has no setup function")
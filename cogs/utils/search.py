@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory trigram index for fuzzy name lookups.
+'''
+
+from __future__ import annotations
+
+import heapq
+import math
+from array import array
+from collections import defaultdict
+from typing import Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+def trigrams(text: str, *, partial: bool = False) -> set[str]:
+    '''Returns the trigrams of the words in `text`.
+
+    Words are padded with a space at the start, so word prefixes share more trigrams
+    than other substrings. With `partial`, words are not padded at the end either,
+    so that they also match longer words they are a prefix of.
+    '''
+    grams = set()
+    for word in text.lower().split():
+        word = f" {word}" if partial and len(word) >= 2 else f" {word} "
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+class TrigramIndex(Generic[T]):
+    '''An immutable index of string keys, searchable by partial and misspelled queries.'''
+    def __init__(self, entries: Iterable[tuple[str, T]]):
+        self.keys: list[str] = []
+        self.values: list[T] = []
+        postings: defaultdict[str, list[int]] = defaultdict(list)
+        # Shorter keys get lower IDs, so that posting lists are ordered by length
+        for i, (key, value) in enumerate(sorted(entries, key=lambda entry: (len(entry[0]), entry[0].lower()))):
+            self.keys.append(key.lower())
+            self.values.append(value)
+            for gram in trigrams(key):
+                postings[gram].append(i)
+        # Compact arrays rather than sets, since there may be millions of postings
+        self.postings = {gram: array("I", ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, *, limit: int = 10, fuzzy: bool = True) -> list[tuple[str, T]]:
+        '''Returns up to `limit` entries matching `query`, best first.
+
+        Entries containing every word of the query as a substring are ranked by how many
+        of the words are word prefixes, then by length. Only if there are none are
+        entries ranked by the number of trigrams shared with the query.
+        '''
+        grams = trigrams(query, partial=True)
+        if not grams:
+            return []
+        words = query.lower().split()
+        lists = sorted((self.postings.get(gram, array("I")) for gram in grams), key=len)
+        # Every exact match contains the rarest trigram, so it is enough to verify those entries
+        exact: list[tuple[int, int]] = []
+        best_matches = 0
+        for i in lists[0]:
+            key = self.keys[i]
+            if all(word in key for word in words):
+                padded = f" {key}"
+                prefixes = sum(f" {word}" in padded for word in words)
+                exact.append((-prefixes, i))
+                # Later entries are no shorter, so they can't rank above these
+                best_matches += prefixes == len(words)
+                if best_matches == limit:
+                    break
+        if exact:
+            best = [i for _, i in heapq.nsmallest(limit, exact)]
+        elif fuzzy:
+            # An entry sharing `required` trigrams must appear in one of the rarest lists
+            required = min(len(grams), max(2, math.ceil(len(grams) / 3)))
+            candidates = set().union(*lists[:len(grams) - required + 1])
+            scores = {}
+            for i in candidates:
+                # Query trigrams never span words, so this is the same as intersecting trigram sets
+                padded = f" {self.keys[i]} "
+                shared = sum(gram in padded for gram in grams)
+                if shared >= required:
+                    scores[i] = shared
+            best = heapq.nsmallest(limit, scores, key=lambda i: (-scores[i], i))
+        else:
+            best = []
+        return [(self.keys[i], self.values[i]) for i in best]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Fixed-size latency histograms for command instrumentation.
+'''
+
+from __future__ import annotations
+
+import bisect
+from collections import defaultdict
+
+class Histogram:
+    '''A histogram of durations in logarithmically spaced buckets.
+
+    Memory use is constant regardless of the number of samples. Quantiles are
+    accurate to within one bucket, i.e. about 20%.
+    '''
+    # Bucket upper bounds in seconds, from 50 µs to ~14 minutes
+    BOUNDS = [50e-6 * 1.2 ** i for i in range(92)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        '''Returns an upper bound for the `q`th quantile, in seconds.'''
+        if self.total == 0:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+class LatencyStats:
+    '''Latency histograms for each phase of each command, and aggregated per cog.'''
+    # Phases, in the order they happen
+    PHASES = ("context", "checks", "callback", "send", "react", "total")
+
+    def __init__(self):
+        self.commands: defaultdict[str, defaultdict[str, Histogram]] = defaultdict(lambda: defaultdict(Histogram))
+        self.cogs: defaultdict[str, defaultdict[str, Histogram]] = defaultdict(lambda: defaultdict(Histogram))
+
+    def record(self, command: str, cog: str, phase: str, seconds: float):
+        self.commands[command][phase].record(seconds)
+        self.cogs[cog][phase].record(seconds)
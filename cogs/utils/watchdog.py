@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''
+Detection of event loop stalls.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable, Optional
+
+class LoopWatchdog:
+    '''Measures event loop scheduling lag, and captures the loop thread's stack when it stalls.
+
+    A coroutine on the loop wakes up every `interval` seconds and records how late it was.
+    A separate thread notices when those wakeups stop for longer than `threshold`
+    seconds, and captures the stack of the loop thread while it is still blocked.
+    Once the loop recovers, `report` is awaited with the length of the stall and that stack.
+    '''
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        report: Callable[[float, str], Awaitable[None]],
+        *,
+        interval: float = 0.5,
+        threshold: float = 1.0,
+    ):
+        self.loop = loop
+        self.report = report
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_beat = time.monotonic()
+        self.stack: Optional[str] = None
+        self.loop_thread: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        '''Starts monitoring. Must be called from the thread running the loop.'''
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = self.loop.create_task(self.beat())
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def beat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            self.lag = max(0.0, self.last_beat - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            if self.lag >= self.threshold:
+                self.stalls += 1
+                stack, self.stack = self.stack, None
+                # Reporting must not take the monitor down with it
+                self.loop.create_task(self.report(self.lag, stack or "(stack not captured)"))
+
+    def watch(self):
+        # Runs in its own thread, so it keeps running while the loop is blocked
+        while not self.stopped.wait(self.interval / 2):
+            stalled = time.monotonic() - self.last_beat - self.interval
+            if stalled >= self.threshold and self.stack is None:
+                frame = sys._current_frames().get(self.loop_thread) # type: ignore
+                if frame is not None:
+                    self.stack = "".join(traceback.format_stack(frame))
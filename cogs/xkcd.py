@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
 import contextlib
 import datetime
-import json
+import logging
 import random
-from typing import TYPE_CHECKING, Optional
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Any, Optional
 
+import aiohttp
 import discord
 from discord.ext import menus  # type: ignore
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 if TYPE_CHECKING:
     from bot import Bot, Ctx
@@ -17,24 +20,66 @@ else:
     Ctx = commands.Context
 
 class XkcdMenu(menus.Menu):
-    '''A menu that fetches its page source from XKCD.'''
+    '''A menu that fetches its page source from XKCD.
+    
+    The comics reachable with a single button press are prefetched in the background,
+    so that most page flips are served from the cache.
+    '''
+    # Maximum number of comics a single menu may prefetch
+    PREFETCH_BUDGET = 20
+
     def __init__(self, number: int, **kwargs):
         self.current = number
+        self.next_random = 1
+        self.prefetch_budget = self.PREFETCH_BUDGET
+        self.prefetch_task: Optional[asyncio.Task] = None
         super().__init__(delete_message_after=True, **kwargs)
 
     async def send_initial_message(self, ctx: Ctx, channel: discord.TextChannel):
         embed = await self.ctx.cog.query_xkcd(self.current)
+        self.schedule_prefetch()
         return await channel.send(embed=embed)
 
     async def show_page(self, page_number: int):
         self.current = page_number
         embed = await self.ctx.cog.query_xkcd(page_number)
         await self.message.edit(embed=embed)
+        self.schedule_prefetch()
     
     async def show_checked_page(self, page_number: int):
         if 1 <= page_number <= self.ctx.cog.latest_number:
             await self.show_page(page_number)
 
+    def prefetch_targets(self) -> list[int]:
+        '''Returns the comics reachable from the current one, and picks the next random comic.'''
+        latest = self.ctx.cog.latest_number
+        self.next_random = random.randint(1, latest)
+        targets = [self.current - 1, self.current + 1, self.next_random, latest]
+        return [n for n in targets if 1 <= n <= latest]
+
+    def schedule_prefetch(self):
+        '''Replaces any pending prefetch with one for the current neighbours.'''
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+        targets = self.prefetch_targets()
+        if self.prefetch_budget > 0:
+            self.prefetch_task = self.bot.loop.create_task(self.prefetch(targets))
+
+    async def prefetch(self, targets: list[int]):
+        cog = self.ctx.cog
+        for number in targets:
+            if self.prefetch_budget <= 0:
+                return
+            if number in cog.embeds or number in cog.missing:
+                continue
+            self.prefetch_budget -= 1
+            with contextlib.suppress(ValueError, aiohttp.ClientError, asyncio.TimeoutError):
+                await cog.query_xkcd(number)
+
+    async def finalize(self, timed_out: bool):
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+
     @menus.button("\N{BLACK LEFT-POINTING DOUBLE TRIANGLE WITH VERTICAL BAR}\ufe0f")
     async def first_comic(self, payload):
         if self.current != 1:
@@ -46,7 +91,7 @@ class XkcdMenu(menus.Menu):
 
     @menus.button("\N{TWISTED RIGHTWARDS ARROWS}") # Discord rejects a variation selector here!
     async def random_comic(self, payload):
-        await self.show_page(random.randint(1, self.ctx.cog.latest_number))
+        await self.show_checked_page(self.next_random)
 
     @menus.button("\N{BLACK RIGHT-POINTING TRIANGLE}\ufe0f")
     async def next_comic(self, payload):
@@ -61,35 +106,268 @@ class XkcdMenu(menus.Menu):
     async def stop_menu(self, payload):
         self.stop()
 
+class XkcdSearchMenu(XkcdMenu, inherit_buttons=False):
+    '''A menu that pages through XKCD search results, best match first.'''
+    def __init__(self, results: list[int], **kwargs):
+        self.results = results
+        self.index = 0
+        super().__init__(number=results[0], **kwargs)
+
+    async def show_result(self, index: int):
+        if 0 <= index < len(self.results) and index != self.index:
+            self.index = index
+            await self.show_page(self.results[index])
+
+    def prefetch_targets(self) -> list[int]:
+        last = len(self.results) - 1
+        self.next_random = random.randint(0, last)
+        targets = [self.index - 1, self.index + 1, self.next_random, last]
+        return [self.results[i] for i in targets if 0 <= i <= last]
+
+    @menus.button("\N{BLACK LEFT-POINTING DOUBLE TRIANGLE WITH VERTICAL BAR}\ufe0f")
+    async def first_result(self, payload):
+        await self.show_result(0)
+
+    @menus.button("\N{BLACK LEFT-POINTING TRIANGLE}\ufe0f")
+    async def previous_result(self, payload):
+        await self.show_result(self.index - 1)
+
+    @menus.button("\N{TWISTED RIGHTWARDS ARROWS}") # Discord rejects a variation selector here!
+    async def random_result(self, payload):
+        await self.show_result(self.next_random)
+
+    @menus.button("\N{BLACK RIGHT-POINTING TRIANGLE}\ufe0f")
+    async def next_result(self, payload):
+        await self.show_result(self.index + 1)
+
+    @menus.button("\N{BLACK RIGHT-POINTING DOUBLE TRIANGLE WITH VERTICAL BAR}\ufe0f")
+    async def last_result(self, payload):
+        await self.show_result(len(self.results) - 1)
+
+    @menus.button("\N{BLACK SQUARE FOR STOP}\ufe0f")
+    async def stop_menu(self, payload):
+        self.stop()
+
 class Xkcd(commands.Cog):
     '''Commands for interfacing with XKCD'''
 
+    # Number of built embeds kept in memory
+    EMBED_CACHE_SIZE = 256
+    # Archive backfill: concurrent requests, comics per checkpoint,
+    # the pause between batches, and the longest pause after errors (seconds),
+    # and the attempts at a comic before it is recorded as failed
+    BACKFILL_CONCURRENCY = 4
+    BACKFILL_BATCH_SIZE = 20
+    BACKFILL_DELAY = 1.0
+    BACKFILL_MAX_BACKOFF = 300.0
+    BACKFILL_MAX_ATTEMPTS = 5
+    # Number of search results shown, and the ranking weights of
+    # the title, alt text and transcript
+    SEARCH_LIMIT = 25
+    SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+    # Number of notification DMs in flight at once
+    NOTIFY_CONCURRENCY = 8
+    # Polling schedule (seconds). New comics are usually published on Monday,
+    # Wednesday and Friday shortly after midnight US Eastern time, which is
+    # polled frequently; the rest of the week is polled rarely.
+    RELEASE_DAYS = (0, 2, 4)
+    RELEASE_WINDOW = (datetime.time(3, 30), datetime.time(8, 0)) # UTC
+    POLL_RELEASE_INTERVAL = 120.0
+    POLL_IDLE_INTERVAL = 1800.0
+    POLL_MAX_BACKOFF = 3600.0
+    POLL_JITTER = 0.1
+
     def __init__(self, bot: Bot):
         self.bot = bot
         self.latest_number = 1
+        # Comic metadata never changes once published, so the cache is two-tiered:
+        # built embeds in a bounded LRU, and the raw metadata in the database.
+        # Numbers that XKCD does not serve (such as #404) are cached negatively.
+        self.embeds: OrderedDict[int, discord.Embed] = OrderedDict()
+        self.missing: set[int] = set()
+        self.cache_stats: Counter[str] = Counter()
+        self.backfill_task: Optional[asyncio.Task] = None
+        self.poll_task: Optional[asyncio.Task] = None
+        # Validators of the last response to the latest comic poll
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.poll_failures = 0
     
     @commands.Cog.listener()
     async def on_initialized(self): # Called once bot.session and bot.db are ready
-        async with self.bot.cursor() as cur:
-            await cur.execute(
-                '''
-                SELECT last_xkcd FROM stats;
-                '''
-            )
-            # hohoho pistol operator goes boom
-            self.latest_number ,= await cur.fetchone()
-        if not self.update_xkcd.is_running():
-            self.update_xkcd.start()
+        rows = await self.bot.db.fetchall(
+            '''
+            SELECT num FROM xkcd_missing;
+            '''
+        )
+        self.missing = {num for (num,) in rows}
+        # hohoho pistol operator goes boom
+        self.latest_number ,= await self.bot.db.fetchone(
+            '''
+            SELECT last_xkcd FROM stats;
+            '''
+        )
+        backfill = await self.bot.db.fetchone(
+            '''
+            SELECT running FROM xkcd_backfill;
+            '''
+        )
+        if self.poll_task is None or self.poll_task.done():
+            self.poll_task = self.bot.loop.create_task(self.poll_forever())
+        # Resume an interrupted backfill after a restart or reload
+        if backfill is not None and backfill[0]:
+            self.start_backfill()
+
+    def cog_export_state(self) -> dict[str, Any]:
+        return {
+            "latest_number": self.latest_number,
+            "embeds": self.embeds,
+            "cache_stats": self.cache_stats,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+        }
+
+    def cog_import_state(self, state: dict[str, Any]):
+        self.latest_number = state["latest_number"]
+        self.embeds = state["embeds"]
+        self.cache_stats = state["cache_stats"]
+        self.etag = state["etag"]
+        self.last_modified = state["last_modified"]
 
     def cog_unload(self):
-        if self.update_xkcd.is_running():
-            self.update_xkcd.cancel()
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        # The checkpoint stays marked as running, so the next instance resumes it
+        if self.backfill_task is not None:
+            self.backfill_task.cancel()
+
+    def start_backfill(self) -> bool:
+        '''Starts the archive backfill unless it is already running.'''
+        if self.backfill_task is not None and not self.backfill_task.done():
+            return False
+        self.backfill_task = self.bot.loop.create_task(self.run_backfill())
+        return True
+
+    async def run_backfill(self):
+        '''Downloads every comic up to the latest one into the database.
+        
+        Comics are fetched in batches of bounded concurrency. The start of the next
+        batch is checkpointed after each one, so an interrupted backfill resumes
+        where it left off. Comics that keep failing are recorded in `xkcd_failed`
+        and skipped.
+        '''
+        row = await self.bot.db.fetchone(
+            '''
+            SELECT next FROM xkcd_backfill;
+            '''
+        )
+        start = 1 if row is None else row[0]
+        await self.checkpoint_backfill(start, running=True)
+
+        semaphore = asyncio.Semaphore(self.BACKFILL_CONCURRENCY)
+        async def fetch(number: int):
+            async with semaphore:
+                await self.store_xkcd(await self.fetch_xkcd(number))
+
+        attempts: Counter[int] = Counter()
+        failed: set[int] = set()
+        backoff = self.BACKFILL_DELAY
+        batch_start = start
+        while batch_start <= self.latest_number:
+            batch_end = min(batch_start + self.BACKFILL_BATCH_SIZE, self.latest_number + 1)
+            pending = [n for n in await self.missing_comics(batch_start, batch_end) if n not in failed]
+            results = await asyncio.gather(*(fetch(number) for number in pending), return_exceptions=True)
+            for number, result in zip(pending, results):
+                # 404s are already recorded as missing
+                if not isinstance(result, Exception) or number in self.missing:
+                    continue
+                attempts[number] += 1
+                await self.bot.log_raw(
+                    level=logging.INFO,
+                    message=f"XKCD backfill attempt {attempts[number]}/{self.BACKFILL_MAX_ATTEMPTS} at #{number} failed",
+                    exc=result
+                )
+                if attempts[number] >= self.BACKFILL_MAX_ATTEMPTS:
+                    failed.add(number)
+                    await self.bot.db.execute(
+                        '''
+                        INSERT INTO xkcd_failed (num, error) VALUES (?, ?)
+                        ON CONFLICT(num) DO UPDATE SET error = excluded.error;
+                        ''',
+                        (number, repr(result))
+                    )
+                    await self.bot.log_raw(
+                        level=logging.WARNING,
+                        message=f"XKCD backfill skipped #{number} after {attempts[number]} failed attempts",
+                        exc=result
+                    )
+            # Comics that failed for any reason other than a 404 are retried
+            if [n for n in await self.missing_comics(batch_start, batch_end) if n not in failed]:
+                backoff = min(backoff * 2, self.BACKFILL_MAX_BACKOFF)
+                await asyncio.sleep(backoff)
+                continue
+
+            backoff = self.BACKFILL_DELAY
+            batch_start = batch_end
+            await self.checkpoint_backfill(batch_start, running=True)
+            if pending:
+                await asyncio.sleep(self.BACKFILL_DELAY)
+
+        await self.checkpoint_backfill(batch_start, running=False)
+        await self.bot.log_raw(message=f"XKCD backfill finished at #{batch_start - 1}")
+
+    async def missing_comics(self, start: int, end: int) -> list[int]:
+        '''Returns the numbers in `range(start, end)` that are neither stored nor known missing.'''
+        rows = await self.bot.db.fetchall(
+            '''
+            SELECT num FROM xkcd_comics WHERE num >= ? AND num < ?;
+            ''',
+            (start, end)
+        )
+        stored = {num for (num,) in rows}
+        return [n for n in range(start, end) if n not in stored and n not in self.missing]
+
+    async def checkpoint_backfill(self, next: int, *, running: bool):
+        '''Records the progress of the archive backfill.'''
+        await self.bot.db.execute(
+            '''
+            INSERT INTO xkcd_backfill (id, next, running)
+            VALUES (0, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                next = excluded.next,
+                running = excluded.running;
+            ''',
+            (next, int(running))
+        )
+
+    async def poll_forever(self):
+        '''Runs `update_xkcd` repeatedly, sleeping for `poll_delay` after each run.
+
+        The delay is computed after the poll, so that it reflects its outcome.
+        '''
+        while True:
+            try:
+                await self.update_xkcd()
+            except Exception as exc:
+                self.poll_failures += 1
+                await self.bot.log_raw(level=logging.ERROR, message="XKCD update failed", exc=exc)
+            await asyncio.sleep(self.poll_delay(datetime.datetime.utcnow()))
 
-    @tasks.loop(minutes=15)
     async def update_xkcd(self):
         '''Checks for a new XKCD and sends update DMs to all opted in'''
-        async with self.bot.session.get("https://xkcd.com/info.0.json") as resp:
-            data = json.loads(await resp.text())
+        try:
+            result = await self.poll_xkcd()
+        except (ValueError, aiohttp.ClientError, asyncio.TimeoutError):
+            self.poll_failures += 1
+            return
+        else:
+            self.poll_failures = 0
+        # Not modified since the last poll
+        if result is None:
+            return
+        data, etag, last_modified = result
+        # Storing the comic also adds it to the search index
+        await self.store_xkcd(data)
         if data["num"] > self.latest_number:
             await self.send_notifications(data["num"])
             self.latest_number = data["num"]
@@ -99,31 +377,98 @@ class Xkcd(commands.Cog):
                 ''',
                 (data["num"],)
             )
+        # Only now is the comic fully handled, so that a failure above is retried by the next poll
+        self.etag, self.last_modified = etag, last_modified
+
+    async def poll_xkcd(self) -> Optional[tuple[dict[str, Any], Optional[str], Optional[str]]]:
+        '''Conditionally fetches the latest comic, along with its `ETag` and `Last-Modified` validators.
+
+        Returns None if it has not changed since the last poll. The validators are only
+        sent with later polls once `update_xkcd` commits them.
+        '''
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        resp = await self.bot.session.get("https://xkcd.com/info.0.json", headers=headers)
+        if resp.status == 304:
+            return None
+        if resp.status != 200:
+            raise ValueError(None)
+        return resp.json(), resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+    def poll_delay(self, now: datetime.datetime) -> float:
+        '''Returns the number of seconds to wait before the next poll, given the current UTC time.'''
+        if self.poll_failures:
+            delay = min(self.POLL_RELEASE_INTERVAL * 2 ** self.poll_failures, self.POLL_MAX_BACKOFF)
+        else:
+            delay = self.POLL_IDLE_INTERVAL
+            start, end = self.RELEASE_WINDOW
+            for offset in range(8):
+                day = now.date() + datetime.timedelta(days=offset)
+                if day.weekday() not in self.RELEASE_DAYS:
+                    continue
+                window_start = datetime.datetime.combine(day, start)
+                window_end = datetime.datetime.combine(day, end)
+                if window_start <= now < window_end:
+                    delay = self.POLL_RELEASE_INTERVAL
+                    break
+                if now < window_start:
+                    # Don't sleep through the start of the next release window
+                    delay = min(delay, max((window_start - now).total_seconds(), self.POLL_RELEASE_INTERVAL))
+                    break
+        return delay * random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER)
 
     async def send_notifications(self, latest_number):
         '''Sends notifications to all who have been opted in'''
+        # Each embed is built once and shared by every recipient
+        embeds: list[tuple[int, dict[str, Any]]] = []
+        for num in range(self.latest_number + 1, latest_number + 1):
+            with contextlib.suppress(ValueError):
+                embeds.append((num, (await self.query_xkcd(num)).to_dict()))
+        # Recent opt-ins and opt-outs may not be committed yet
+        await self.bot.db.users.flush()
         rows = await self.bot.db.fetchall(
             '''
-            SELECT id FROM users WHERE xkcd_remind = 1;
-            '''
-        )
-        for (id,) in rows:
-            with contextlib.suppress(discord.Forbidden):
-                for num in range(self.latest_number + 1, latest_number + 1):
-                    embed = await self.query_xkcd(num)
-                    # Raw methods are used here due to a lack of member cache
-                    # If `members` intent is enabled, `m = get_member(ID)` and `m.send(...)` may be used
-                    channel = await self.bot.http.start_private_message(id) # type: ignore
-                    chan_id = channel["id"]
-                    await self.bot.http.send_message( # type: ignore
-                        chan_id,
-                        "\n".join([
-                            f"XKCD #`{num}`",
-                            "*You're being reminded because you opted in using `rocket opt in`.*",
-                            "*To opt out from reminders, use `rocket opt out`.*"
-                        ]),
-                        embed=embed.to_dict()
-                    )
+            SELECT id, dm_channel FROM users WHERE xkcd_remind = 1;
+            '''
+        )
+        # The HTTP client waits out per-route and global rate limits on its own,
+        # the cap keeps the number of requests queued behind them bounded
+        semaphore = asyncio.Semaphore(self.NOTIFY_CONCURRENCY)
+
+        async def notify(id: int, channel_id: Optional[int]):
+            async with semaphore:
+                # Raw methods are used here due to a lack of member cache
+                # If `members` intent is enabled, `m = get_member(ID)` and `m.send(...)` may be used
+                with contextlib.suppress(discord.Forbidden):
+                    if channel_id is None:
+                        channel = await self.bot.http.start_private_message(id) # type: ignore
+                        channel_id = int(channel["id"])
+                        self.bot.db.users.update(id, dm_channel=channel_id)
+                    for num, embed in embeds:
+                        await self.bot.http.send_message( # type: ignore
+                            channel_id,
+                            "\n".join([
+                                f"XKCD #`{num}`",
+                                "*You're being reminded because you opted in using `rocket opt in`.*",
+                                "*To opt out from reminders, use `rocket opt out`.*"
+                            ]),
+                            embed=embed
+                        )
+
+        results = await asyncio.gather(
+            *(notify(id, channel_id) for id, channel_id in rows),
+            return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures:
+            await self.bot.log_raw(
+                level=logging.WARNING,
+                message=f"{len(failures)}/{len(rows)} XKCD notifications failed",
+                exc=failures[0]
+            )
 
     @commands.group(invoke_without_command=True)
     async def xkcd(self, ctx: Ctx, *, number: Optional[int]):
@@ -144,19 +489,120 @@ class Xkcd(commands.Cog):
         '''Returns the latest comic.'''
         await XkcdMenu(number=self.latest_number).start(ctx)
 
+    @xkcd.command()
+    async def search(self, ctx: Ctx, *, terms: str):
+        '''Searches comics by their title, alt text and transcript.
+        
+        The best matches are shown first. The last term also matches as a prefix.
+        '''
+        # Quoting each term keeps FTS5 syntax in user input from being interpreted
+        words = ['"' + word.replace('"', '""') + '"' for word in terms.split()]
+        if not words:
+            return await ctx.boom("No search terms given")
+        words[-1] += "*"
+        rows = await self.bot.db.fetchall(
+            f'''
+            SELECT rowid FROM xkcd_search
+            WHERE xkcd_search MATCH ?
+            ORDER BY bm25(xkcd_search, {", ".join(map(str, self.SEARCH_WEIGHTS))})
+            LIMIT ?;
+            ''',
+            (" ".join(words), self.SEARCH_LIMIT)
+        )
+        if not rows:
+            return await ctx.boom(f"No comics found for `{terms}`")
+        await XkcdSearchMenu(results=[num for (num,) in rows]).start(ctx)
+
     async def query_xkcd(self, number = None) -> discord.Embed:
-        '''Queries XKCD and returns an embed with the content.'''
+        '''Returns an embed with the content of a comic, querying XKCD only on a cache miss.'''
+        if number is None:
+            data = await self.fetch_xkcd()
+            await self.store_xkcd(data)
+            return self.cache_embed(data)
+
+        embed = self.embeds.get(number)
+        if embed is not None:
+            self.embeds.move_to_end(number)
+            self.cache_stats["memory_hits"] += 1
+            return embed
+        if number in self.missing:
+            self.cache_stats["negative_hits"] += 1
+            raise ValueError(number)
+
+        row = await self.bot.db.fetchone(
+            '''
+            SELECT * FROM xkcd_comics WHERE num = ?;
+            ''',
+            (number,)
+        )
+        if row is not None:
+            self.cache_stats["db_hits"] += 1
+            return self.cache_embed(dict(row))
+
+        self.cache_stats["misses"] += 1
+        data = await self.fetch_xkcd(number)
+        await self.store_xkcd(data)
+        return self.cache_embed(data)
+
+    async def fetch_xkcd(self, number = None) -> dict[str, Any]:
+        '''Fetches the metadata of a comic from XKCD. Missing comics are cached negatively.'''
         if number is None:
             path = "https://xkcd.com/info.0.json"
         else:
             path = f"https://xkcd.com/{number}/info.0.json"
         
-        async with self.bot.session.get(path) as resp:
-            if resp.status != 200:
-                raise ValueError(number)
-            
-            data = json.loads(await resp.text())
+        resp = await self.bot.session.get(path)
+        if resp.status == 404 and number is not None:
+            self.missing.add(number)
+            await self.bot.db.execute(
+                '''
+                INSERT OR IGNORE INTO xkcd_missing (num) VALUES (?);
+                ''',
+                (number,)
+            )
+        if resp.status != 200:
+            raise ValueError(number)
         
+        return resp.json()
+
+    async def store_xkcd(self, data: dict[str, Any]):
+        '''Stores the metadata of a comic in the database.'''
+        await self.bot.db.execute(
+            '''
+            INSERT INTO xkcd_comics (num, safe_title, alt, transcript, img, year, month, day)
+            VALUES (:num, :safe_title, :alt, :transcript, :img, :year, :month, :day)
+            ON CONFLICT(num) DO UPDATE SET
+                safe_title = excluded.safe_title,
+                alt = excluded.alt,
+                transcript = excluded.transcript,
+                img = excluded.img,
+                year = excluded.year,
+                month = excluded.month,
+                day = excluded.day;
+            ''',
+            {
+                "num": data["num"],
+                "safe_title": data["safe_title"],
+                "alt": data["alt"],
+                "transcript": data.get("transcript", ""),
+                "img": data["img"],
+                "year": data["year"],
+                "month": data["month"],
+                "day": data["day"],
+            }
+        )
+
+    def cache_embed(self, data: dict[str, Any]) -> discord.Embed:
+        '''Builds an embed from comic metadata and stores it in the LRU.'''
+        embed = self.build_embed(data)
+        self.embeds[data["num"]] = embed
+        self.embeds.move_to_end(data["num"])
+        while len(self.embeds) > self.EMBED_CACHE_SIZE:
+            self.embeds.popitem(last=False)
+        return embed
+
+    def build_embed(self, data: dict[str, Any]) -> discord.Embed:
+        '''Builds an embed from comic metadata.'''
         day, month, year = data["day"], data["month"], data["year"]
         stamp = datetime.datetime(int(year), int(month), int(day))
         
@@ -164,22 +610,95 @@ class Xkcd(commands.Cog):
             color = self.bot.color,
             title=data["safe_title"],
             timestamp=stamp,
-            url=f"https://xkcd.com/{number}",
+            url=f"https://xkcd.com/{data['num']}",
         )
         embed.set_image(url=data["img"])
         embed.set_footer(text=data["alt"])
         return embed
 
+    @xkcd.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def backfill(self, ctx: Ctx):
+        '''Starts downloading the XKCD archive in the background.'''
+        if self.start_backfill():
+            await ctx.rocket()
+        else:
+            await ctx.send("The backfill is already running.")
+
+    @backfill.command(name="status")
+    @commands.is_owner()
+    async def backfill_status(self, ctx: Ctx):
+        '''Shows the progress of the archive backfill.'''
+        row = await self.bot.db.fetchone(
+            '''
+            SELECT next FROM xkcd_backfill;
+            '''
+        )
+        next = 1 if row is None else row[0]
+        stored ,= await self.bot.db.fetchone(
+            '''
+            SELECT COUNT(*) FROM xkcd_comics;
+            '''
+        )
+        # Comics fetched on demand since they failed are no longer missing
+        failed ,= await self.bot.db.fetchone(
+            '''
+            SELECT COUNT(*) FROM xkcd_failed WHERE num NOT IN (SELECT num FROM xkcd_comics);
+            '''
+        )
+        running = self.backfill_task is not None and not self.backfill_task.done()
+        await ctx.send(
+            f"Backfill {'running' if running else 'stopped'}: checkpoint at `{next - 1}/{self.latest_number}`, "
+            f"`{stored}` comics stored, `{len(self.missing)}` missing, `{failed}` failed."
+        )
+
+    @backfill.command(name="stop")
+    @commands.is_owner()
+    async def backfill_stop(self, ctx: Ctx):
+        '''Stops the archive backfill. It can be resumed later.'''
+        if self.backfill_task is None or self.backfill_task.done():
+            return await ctx.send("The backfill is not running.")
+        self.backfill_task.cancel()
+        row = await self.bot.db.fetchone(
+            '''
+            SELECT next FROM xkcd_backfill;
+            '''
+        )
+        await self.checkpoint_backfill(row[0], running=False)
+        await ctx.rocket()
+
+    @xkcd.command(hidden=True)
+    @commands.is_owner()
+    async def cache(self, ctx: Ctx):
+        '''Shows XKCD cache statistics.'''
+        stats = self.cache_stats
+        hits = stats["memory_hits"] + stats["db_hits"] + stats["negative_hits"]
+        total = hits + stats["misses"]
+        rate = hits / total if total else 0.0
+        await ctx.send("\n".join([
+            "```",
+            f"Memory hits:   {stats['memory_hits']}",
+            f"Database hits: {stats['db_hits']}",
+            f"Negative hits: {stats['negative_hits']}",
+            f"Misses:        {stats['misses']}",
+            f"Hit rate:      {rate:.1%}",
+            f"Embeds cached: {len(self.embeds)}/{self.EMBED_CACHE_SIZE}",
+            f"Known missing: {len(self.missing)}",
+            "```",
+        ]))
+
     @commands.group(invoke_without_command=True)
     async def opt(self, ctx: Ctx):
         '''Opt in or out from XKCD reminders.'''
-        fetch = await self.bot.db.fetchone(
-            '''
-            SELECT xkcd_remind FROM users WHERE id = ?;
-            ''',
-            (ctx.author.id, )
-        )
-        result = False if fetch is None else fetch[0]
+        result = self.bot.db.users.get(ctx.author.id, "xkcd_remind")
+        if result is None:
+            fetch = await self.bot.db.fetchone(
+                '''
+                SELECT xkcd_remind FROM users WHERE id = ?;
+                ''',
+                (ctx.author.id, )
+            )
+            result = False if fetch is None else fetch[0]
         if result:
             await ctx.send("You are currently opted in to XKCD reminders.")
         else:
@@ -189,29 +708,13 @@ class Xkcd(commands.Cog):
     @opt.command(name="in")
     async def optin(self, ctx: Ctx):
         '''Opt in.'''
-        await self.bot.db.execute(
-            '''
-            INSERT INTO users (id, xkcd_remind)
-            VALUES (?, 1)
-            ON CONFLICT(id) DO UPDATE
-            SET xkcd_remind = excluded.xkcd_remind;
-            ''',
-            ctx.author.id
-        )
+        self.bot.db.users.update(ctx.author.id, xkcd_remind=1)
         await ctx.send("You were opted in to XKCD reminders.")
 
     @opt.command(name="out")
     async def optout(self, ctx: Ctx):
         '''Opt out.'''
-        await self.bot.db.execute(
-            '''
-            INSERT INTO users (id, xkcd_remind)
-            VALUES (?, 0)
-            ON CONFLICT(id) DO UPDATE
-            SET xkcd_remind = excluded.xkcd_remind;
-            ''',
-            ctx.author.id
-        )
+        self.bot.db.users.update(ctx.author.id, xkcd_remind=0)
         await ctx.send("You were opted out from XKCD reminders.")
 
 def setup(bot: Bot):
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the pagination of character info.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import random
+
+from cogs.tools import CharsSource, describe
+
+class FakeMenu:
+    def __init__(self, page: int):
+        self.current_page = page
+
+def pages(source: CharsSource) -> list[str]:
+    return [
+        asyncio.run(source.format_page(FakeMenu(number), source.entries[number])) # type: ignore
+        for number in range(source.get_max_pages())
+    ]
+
+def test_long_names_fit():
+    # Among the longest character names, with the widest escapes
+    text = "\U0001F9D1‍\U0001F91D‍\U0001F9D1" * 60 + "ﯹ" * 200
+    source = CharsSource(text)
+    formatted = pages(source)
+    assert len(formatted) > 1
+    assert all(len(page) <= 2000 for page in formatted)
+
+def test_random_text_fits():
+    rng = random.Random(0)
+    for _ in range(20):
+        text = "".join(chr(rng.choice([rng.randrange(0x20, 0x7F), rng.randrange(0x300, 0x370), rng.randrange(0x1F300, 0x1FAFF)])) for _ in range(300))
+        max_length = rng.randrange(200, 2001)
+        source = CharsSource(text, max_length=max_length)
+        assert all(len(page) <= max_length for page in pages(source))
+        assert "".join(text for page in source.entries for text, nested in page if nested is not None) == text
+
+def test_only_shown_pages_are_formatted():
+    describe.cache_clear()
+    source = CharsSource("".join(map(chr, range(0x4E00, 0x5000))))
+    assert describe.cache_info().currsize == 0
+    pages(source)
+    assert describe.cache_info().currsize > 0
+
+def test_short_text_is_one_page():
+    source = CharsSource("abc")
+    assert pages(source) == [
+        "`\\x61`: `a` `LATIN SMALL LETTER A`\n"
+        "`\\x62`: `b` `LATIN SMALL LETTER B`\n"
+        "`\\x63`: `c` `LATIN SMALL LETTER C`"
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of poll reaction parsing.
+'''
+
+from __future__ import annotations
+
+import pathlib
+import types
+
+from cogs.tools import Tools, parse_poll
+from cogs.utils import emoji
+
+TRIE = emoji.load(str(pathlib.Path(__file__).parent.parent / "data" / "emoji.txt"))
+KEYCAPS = types.SimpleNamespace(keycaps={})
+Tools.define_keycaps(KEYCAPS) # type: ignore
+
+def poll(msg: str) -> list[str]:
+    return parse_poll(msg, KEYCAPS.keycaps, TRIE)
+
+def test_single_regional_indicators():
+    assert poll("Which?\n\U0001F1E6 Apples\n\U0001F1E7 Bananas\n1️⃣ one") == [
+        "\U0001F1E6", "\U0001F1E7", "1️⃣"
+    ]
+
+def test_flags_are_not_split():
+    assert poll("\U0001F1EB\U0001F1EE Finland\n\U0001F1EB France") == ["\U0001F1EB\U0001F1EE", "\U0001F1EB"]
+
+def test_unqualified_emoji_are_qualified():
+    assert poll("❤ yes\n\U0001F44D\U0001F3FD sure\nno emoji") == ["❤️", "\U0001F44D\U0001F3FD"]
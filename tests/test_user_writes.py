@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the write-behind buffer for the users table.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import pathlib
+
+from cogs.utils.db import Database
+
+async def connect(path: pathlib.Path) -> Database:
+    db = await Database.connect(str(path / "test.db"), readers=1)
+    db.users.interval = 0.01
+    return db
+
+async def settle(db: Database, timeout: float = 5.0):
+    users = db.users
+    for _ in range(int(timeout / 0.01)):
+        if not (users.pending or users.flushing or (users.task is not None and not users.task.done())):
+            return
+        await asyncio.sleep(0.01)
+
+async def reminded(db: Database) -> dict[int, int]:
+    rows = await db.fetchall("SELECT id, xkcd_remind FROM users;")
+    return {id: remind for id, remind in rows}
+
+def test_update_during_flush_is_committed(tmp_path: pathlib.Path):
+    async def run():
+        db = await connect(tmp_path)
+        transaction = db.transaction
+        @contextlib.asynccontextmanager
+        async def update_midway():
+            async with transaction() as conn:
+                if 2 not in db.users.flushing and 2 not in await reminded(db):
+                    db.users.update(2, xkcd_remind=1)
+                yield conn
+        db.transaction = update_midway # type: ignore
+        db.users.update(1, xkcd_remind=1)
+        await settle(db)
+        assert await reminded(db) == {1: 1, 2: 1}
+        assert not db.users.pending
+        await db.close()
+    asyncio.run(run())
+
+def test_failed_flush_is_retried(tmp_path: pathlib.Path):
+    async def run():
+        db = await connect(tmp_path)
+        errors = []
+        async def report(exc: BaseException):
+            errors.append(exc)
+        db.users.report = report
+        transaction = db.transaction
+        def fail_once():
+            if not errors:
+                raise RuntimeError("disk on fire")
+            return transaction()
+        db.transaction = fail_once # type: ignore
+        db.users.update(1, xkcd_remind=1)
+        assert db.users.get(1, "xkcd_remind") == 1
+        await settle(db)
+        assert len(errors) == 1
+        assert await reminded(db) == {1: 1}
+        await db.close()
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the XKCD polling schedule.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+
+import aiohttp
+import pytest
+
+from cogs.xkcd import Xkcd
+
+# 2021-01-04 was a Monday
+MONDAY = datetime.date(2021, 1, 4)
+
+class FakeBot:
+    async def log_raw(self, **kwargs):
+        pass
+
+def make_cog() -> Xkcd:
+    cog = Xkcd(FakeBot()) # type: ignore
+    cog.POLL_JITTER = 0.0
+    return cog
+
+def at(day: datetime.date, hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+def test_release_window_polls_often():
+    cog = make_cog()
+    assert cog.poll_delay(at(MONDAY, 4)) == cog.POLL_RELEASE_INTERVAL
+
+def test_idle_polls_rarely():
+    cog = make_cog()
+    # Tuesday is not a release day
+    assert cog.poll_delay(at(MONDAY + datetime.timedelta(days=1), 12)) == cog.POLL_IDLE_INTERVAL
+
+def test_idle_wakes_up_for_release_window():
+    cog = make_cog()
+    # 10 minutes before Monday's window opens at 03:30
+    assert cog.poll_delay(at(MONDAY, 3, 20)) == 600.0
+
+def test_failures_back_off():
+    cog = make_cog()
+    cog.poll_failures = 1
+    assert cog.poll_delay(at(MONDAY, 4)) == cog.POLL_RELEASE_INTERVAL * 2
+    cog.poll_failures = 20
+    assert cog.poll_delay(at(MONDAY, 4)) == cog.POLL_MAX_BACKOFF
+
+def test_jitter_is_bounded():
+    cog = Xkcd(FakeBot()) # type: ignore
+    for _ in range(100):
+        delay = cog.poll_delay(at(MONDAY, 4))
+        assert cog.POLL_RELEASE_INTERVAL * 0.9 <= delay <= cog.POLL_RELEASE_INTERVAL * 1.1
+
+def test_sleep_follows_each_poll(monkeypatch: pytest.MonkeyPatch):
+    cog = make_cog()
+    outcomes = [aiohttp.ClientError(), aiohttp.ClientError(), None, RuntimeError()]
+    async def poll_xkcd():
+        outcome = outcomes.pop(0)
+        if outcome is not None:
+            raise outcome
+    monkeypatch.setattr(cog, "poll_xkcd", poll_xkcd)
+
+    class FixedDatetime(datetime.datetime):
+        @classmethod
+        def utcnow(cls):
+            return at(MONDAY + datetime.timedelta(days=1), 12)
+    monkeypatch.setattr(datetime, "datetime", FixedDatetime)
+
+    delays = []
+    async def sleep(delay: float):
+        delays.append(delay)
+        if not outcomes:
+            raise asyncio.CancelledError
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cog.poll_forever())
+    # The delay after a poll already accounts for that poll's outcome
+    assert delays == [
+        cog.POLL_RELEASE_INTERVAL * 2,
+        cog.POLL_RELEASE_INTERVAL * 4,
+        cog.POLL_IDLE_INTERVAL,
+        cog.POLL_RELEASE_INTERVAL * 2,
+    ]
+
+def test_validators_wait_for_a_handled_comic(monkeypatch: pytest.MonkeyPatch):
+    cog = make_cog()
+    comic = {"num": 2}
+    async def poll_xkcd():
+        return comic, '"etag"', "Mon, 04 Jan 2021 05:00:00 GMT"
+    stored = []
+    async def store_xkcd(data):
+        if not stored:
+            stored.append(None)
+            raise RuntimeError("database is locked")
+        stored.append(data)
+    monkeypatch.setattr(cog, "poll_xkcd", poll_xkcd)
+    monkeypatch.setattr(cog, "store_xkcd", store_xkcd)
+    monkeypatch.setattr(cog, "send_notifications", lambda number: asyncio.sleep(0))
+    class FakeDb:
+        async def execute(self, *args):
+            pass
+    cog.bot.db = FakeDb() # type: ignore
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cog.update_xkcd())
+    # The next poll must fetch the comic again rather than get a 304
+    assert cog.etag is None and cog.last_modified is None
+    assert cog.latest_number == 1
+
+    asyncio.run(cog.update_xkcd())
+    assert cog.etag == '"etag"'
+    assert cog.last_modified == "Mon, 04 Jan 2021 05:00:00 GMT"
+    assert cog.latest_number == 2